@@ -0,0 +1,51 @@
+# Per-message cost of the blacklist check: the old loop (one substring scan per
+# word) against the compiled trie regex from compile_words(). Both are checked
+# for the same verdict on every message before timing.
+#
+#   python bench/blacklist_matcher.py [word_count ...]     (default: 10 100 1000)
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot
+
+MESSAGES = 2000
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+def make_messages(rng, words):
+    messages = []
+    for i in range(MESSAGES):
+        text = [random_word(rng, 2, 8) for _ in range(rng.randint(3, 25))]
+        # Roughly one message in ten carries a blacklisted word
+        if i % 10 == 0: text.insert(rng.randrange(len(text) + 1), rng.choice(words))
+        messages.append(" ".join(text))
+    return messages
+
+def main():
+    rng = random.Random(42)
+    for count in [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]:
+        words = set()
+        while len(words) < count: words.add(random_word(rng))
+        messages = make_messages(rng, sorted(words))
+        bot.blacklist_db[count] = words
+        bot.rebuild_blacklist(count)
+
+        def loop():
+            for msg in messages: any(word in msg for word in words)
+
+        def compiled():
+            for msg in messages: bot.blacklist_hit(count, msg)
+
+        for msg in messages:
+            assert any(word in msg for word in words) == bot.blacklist_hit(count, msg), msg
+        before = min(timeit.repeat(loop, number=5, repeat=5)) / (5 * MESSAGES) * 1e6
+        after = min(timeit.repeat(compiled, number=5, repeat=5)) / (5 * MESSAGES) * 1e6
+        print(f"{count} words: loop {before:.1f}us, compiled {after:.1f}us ({before / after:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Memory held by the hunter records: the old 10-key dict (plus shadows list)
+# against the slotted Hunter. Synthetic hunters get unique names and usernames,
+# like real users, and share last_daily/title the way most hunters do.
+#
+#   python bench/hunter_memory.py [count ...]     (default: 100000 1000000)
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot
+
+class NoLeaderboards:
+    # The EXP setter feeds the leaderboards; keep them out of the measurement
+    def on_exp(self, hunter): pass
+
+def old_record(doc):
+    # The record layout before Hunter (hunter_from_doc)
+    return {
+        "name": doc.get("name", "Unknown"),
+        "username": doc.get("username", ""),
+        "exp": doc.get("exp", 0),
+        "last_hunt": doc.get("last_hunt", 0),
+        "last_daily": doc.get("last_daily", ""),
+        "crystals": doc.get("crystals", 0),
+        "streak": doc.get("streak", 0),
+        "loot_boxes": doc.get("loot_boxes", 0),
+        "shadows": doc.get("shadows", []),
+        "title": doc.get("title", "")
+    }
+
+def docs(count):
+    for uid in range(count):
+        yield {
+            "_id": 10**9 + uid, "name": f"Hunter {uid}", "username": f"@hunter{uid}", "exp": uid % 5000,
+            "last_hunt": 1760000000 + uid, "last_daily": "2026-10-18", "crystals": uid % 300, "streak": uid % 7,
+            "loot_boxes": uid % 3, "shadows": [], "title": ""
+        }
+
+def measure(build, count):
+    tracemalloc.start()
+    records = {doc["_id"]: build(doc) for doc in docs(count)}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+def main():
+    bot.leaderboards = NoLeaderboards()
+    sample = next(docs(1))
+    old = old_record(sample)
+    print(f"record container alone: {sys.getsizeof(old) + sys.getsizeof(old['shadows'])} B (dict + list) -> {sys.getsizeof(bot.Hunter.from_doc(sample))} B")
+    for count in [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]:
+        before, after = measure(old_record, count), measure(bot.Hunter.from_doc, count)
+        print(f"{count} hunters: {before / 2**20:.0f} MiB -> {after / 2**20:.0f} MiB ({after / before:.0%})")
+
+if __name__ == "__main__":
+    main()
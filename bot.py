@@ -5,13 +5,23 @@ import json
 import random
 import re
 import httpx
+import importlib.util
 import asyncio
 import time
 import html
 import urllib.parse
 import threading
+import sys
+import signal
+import hashlib
+import hmac
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from array import array
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+import tornado.web
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
     ChatPermissions, ChatMemberAdministrator, ChatMemberOwner, ChatMember
@@ -19,12 +29,13 @@ from telegram import (
 from telegram.constants import ChatAction
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ContextTypes, filters
+    CallbackQueryHandler, ChatMemberHandler, ContextTypes, filters
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from datetime import date, datetime as dt, time as dt_time, timedelta
 from zoneinfo import ZoneInfo
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
+from bisect import bisect_left
 
 # ----------------- CONFIG -----------------
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
@@ -120,18 +131,56 @@ EMOJI_MAP = {
     "💯": '<tg-emoji emoji-id="5362085090723633936">✨</tg-emoji>'
 }
 
-def premium(text):
-    for std, prem in EMOJI_MAP.items():
-        text = text.replace(std, prem)
-    return text
+# One alternation, longest emoji first, so each message is rewritten in a single
+# pass. Static texts (help, errors, shop) hit the memo and cost nothing at all.
+EMOJI_PATTERN = re.compile("|".join(re.escape(std) for std in sorted(EMOJI_MAP, key=len, reverse=True)))
+
+def _premium_emoji(match):
+    return EMOJI_MAP[match.group()]
+
+def rewrite_emoji(text):
+    return EMOJI_PATTERN.sub(_premium_emoji, text)
+
+# Literal texts (help, errors, prompts) are a fixed set, so premium_static keeps
+# every one of them; anything built at runtime goes through premium, uncached, so
+# names, numbers and error strings never crowd the memo.
+premium = rewrite_emoji
+premium_static = lru_cache(maxsize=None)(rewrite_emoji)
+
+# Every proper prefix of a multi-codepoint emoji. A streamed partial ending in
+# one of these is held back a token so "❤" never renders before "❤️‍🩹" lands.
+EMOJI_PREFIXES = {std[:i] for std in EMOJI_MAP for i in range(1, len(std))}
+EMOJI_PREFIX_MAX = max(map(len, EMOJI_PREFIXES), default=0)
 
 # --- BUILT-IN DUMMY SERVER (NO FLASK) ---
+# Polling mode only; webhook mode serves the same routes from its own server.
+HEALTH_TEXT = "🌸 CINDRELLA BOT IS AWAKE AND RUNNING! 🌸"
+
+def metrics_response(token):
+    # (status, body) for /metrics, which is public on the Render URL: it stays off
+    # until METRICS_TOKEN is set, then needs /metrics?token=...
+    secret = os.environ.get("METRICS_TOKEN")
+    if not secret: return 404, b""
+    if not hmac.compare_digest(token.encode(), secret.encode()): return 403, b""
+    try: return 200, json.dumps(metrics_snapshot(), default=str).encode('utf-8')
+    except RuntimeError:
+        # A dict changed size under us on the bot thread; the next scrape will do
+        return 503, b""
+
 class DummyHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path.split("?")[0] == "/metrics": return self.send_metrics()
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
         self.end_headers()
-        self.wfile.write("🌸 CINDRELLA BOT IS AWAKE AND RUNNING! 🌸".encode('utf-8'))
+        self.wfile.write(HEALTH_TEXT.encode('utf-8'))
+
+    def send_metrics(self):
+        status, body = metrics_response(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get("token", [""])[0])
+        self.send_response(status)
+        if body: self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
         pass 
@@ -141,14 +190,10 @@ def run_dummy_server():
     server = HTTPServer(('0.0.0.0', port), DummyHandler)
     server.serve_forever()
 
-def keep_alive():
+async def keep_alive(context: ContextTypes.DEFAULT_TYPE):
     url = os.environ.get("RENDER_EXTERNAL_URL") or os.environ.get("WEBHOOK_URL") or f"http://localhost:{os.environ.get('PORT', 10000)}"
-    while True:
-        time.sleep(300)
-        try:
-            httpx.get(url, timeout=5)
-        except:
-            pass
+    try: await http_request("default", "GET", url, timeout=5)
+    except: pass
 # ----------------------------------------
 
 logging.basicConfig(
@@ -166,19 +211,16 @@ filters_db = defaultdict(dict)
 rules_db = {} 
 spam_tracker = defaultdict(lambda: defaultdict(list)) 
 
-chat_history_db = defaultdict(list)
 recent_messages_db = defaultdict(lambda: deque(maxlen=1000))
 known_groups = {} 
 chat_members_db = defaultdict(set) 
-hunter_db = {} 
+
+blocked_chats = set()
 
 group_msg_counts = defaultdict(int)
 active_dungeons = {}
 arise_targets = {} 
 
-# 100+ Users Load Balancer Queue
-ai_queue = asyncio.Semaphore(4)
-
 ALL_SHADOWS = ["Goblin Chieftain", "Direwolf Alpha", "High Orc Kargal", "Assassin Kasaka", "Giant Iron Golem", "Tank", "Tusk", "Ant King Beru", "Blood-Red Igris", "Kamish", "Bellion"]
 
 DUNGEON_RANKS = {
@@ -201,6 +243,513 @@ WELCOME_MESSAGES = [
 ]
 WELCOME_BG_URL = "https://images.unsplash.com/photo-1519608487953-e999c86e7455?w=1200"
 
+# ----------------- HUNTER STORE -----------------
+# Hunters are loaded from MongoDB on first access and kept in an LRU. A record is
+# only evicted once its pending writes have been flushed, so nothing is lost.
+HUNTER_CACHE_SIZE = int(os.environ.get("HUNTER_CACHE_SIZE", "50000"))
+
+SHADOW_INDEX = {name: i for i, name in enumerate(ALL_SHADOWS)}
+
+class Hunter:
+    # Slotted record instead of a 10-key dict; shadows are a count per ALL_SHADOWS
+    # entry (None until the first extraction) rather than a list of repeated names.
+    __slots__ = ("uid", "name", "username", "_exp", "last_hunt", "last_daily", "crystals", "streak", "loot_boxes", "shadows", "title")
+
+    def __init__(self, uid, name, username="", exp=0, last_hunt=0, last_daily="", crystals=0, streak=0, loot_boxes=0, shadows=None, title=""):
+        self.uid = uid
+        self.name = name
+        self.username = username
+        self.exp = exp
+        self.last_hunt = last_hunt
+        self.last_daily = sys.intern(last_daily)
+        self.crystals = crystals
+        self.streak = streak
+        self.loot_boxes = loot_boxes
+        self.shadows = shadows
+        self.title = sys.intern(title)
+
+    @classmethod
+    def from_doc(cls, doc):
+        hunter = cls(
+            doc["_id"], doc.get("name", "Unknown"), doc.get("username", ""), doc.get("exp", 0), doc.get("last_hunt", 0),
+            doc.get("last_daily", ""), doc.get("crystals", 0), doc.get("streak", 0), doc.get("loot_boxes", 0),
+            title=doc.get("title", "")
+        )
+        for shadow in doc.get("shadows", []): hunter.add_shadow(shadow)
+        return hunter
+
+    # Every EXP change goes through here so the leaderboards never need a full sort
+    @property
+    def exp(self):
+        return self._exp
+
+    @exp.setter
+    def exp(self, value):
+        self._exp = value
+        leaderboards.on_exp(self)
+
+    def to_doc(self):
+        return {
+            "name": self.name, "username": self.username, "exp": self.exp, "last_hunt": self.last_hunt,
+            "last_daily": self.last_daily, "crystals": self.crystals, "streak": self.streak,
+            "loot_boxes": self.loot_boxes, "shadows": self.shadow_list(), "title": self.title,
+            "username_lc": self.username.lower()
+        }
+
+    def shadow_count(self):
+        return sum(self.shadows) if self.shadows else 0
+
+    def shadow_names(self):
+        return [ALL_SHADOWS[i] for i, n in enumerate(self.shadows or ()) if n]
+
+    def shadow_list(self):
+        return [ALL_SHADOWS[i] for i, n in enumerate(self.shadows or ()) for _ in range(n)]
+
+    def add_shadow(self, name):
+        idx = SHADOW_INDEX.get(name)
+        if idx is None: return
+        if self.shadows is None: self.shadows = array("H", bytes(2 * len(ALL_SHADOWS)))
+        if self.shadows[idx] < 0xFFFF: self.shadows[idx] += 1
+
+    def remove_shadow(self, name):
+        idx = SHADOW_INDEX.get(name)
+        if idx is None or not self.shadows or not self.shadows[idx]: return False
+        self.shadows[idx] -= 1
+        if not any(self.shadows): self.shadows = None
+        return True
+
+    def make_owner(self):
+        self.exp, self.crystals, self.loot_boxes = 9999999, 9999999, 9999
+        self.shadows = array("H", [1] * len(ALL_SHADOWS))
+
+class HunterStoreError(Exception):
+    pass
+
+class HunterStore:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.records = OrderedDict()
+        self.stats = {"hits": 0, "loads": 0, "misses": 0, "evictions": 0}
+
+    def __contains__(self, user_id):
+        return user_id in self.records
+
+    def __getitem__(self, user_id):
+        self.records.move_to_end(user_id)
+        return self.records[user_id]
+
+    def __setitem__(self, user_id, data):
+        self.records[user_id] = data
+        self.records.move_to_end(user_id)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, user_id, default=None):
+        return self[user_id] if user_id in self.records else default
+
+    def items(self):
+        return self.records.items()
+
+    async def load(self, user_id):
+        if user_id in self.records:
+            self.stats["hits"] += 1
+            return self[user_id]
+        if hunters_col is None: return None
+        try: doc = await asyncio.to_thread(hunters_col.find_one, {"_id": user_id})
+        except Exception as e:
+            logging.error(f"❌ Hunter Load Error: {e}")
+            raise HunterStoreError(user_id) from e
+        if user_id in self.records: return self[user_id]
+        if not doc:
+            self.stats["misses"] += 1
+            return None
+        self.stats["loads"] += 1
+        self[user_id] = Hunter.from_doc(doc)
+        return self.records[user_id]
+
+    async def ensure(self, user_id, name, username=""):
+        # A blank record is only made when the lookup worked and found nothing; on a
+        # backend error load raises, since the blank would later be upserted over
+        # the real document
+        if await self.load(user_id) is None and user_id not in self.records:
+            self[user_id] = Hunter(user_id, name, username)
+        return self[user_id]
+
+    async def load_many(self, user_ids):
+        missing = [uid for uid in user_ids if uid not in self.records]
+        self.stats["hits"] += len(user_ids) - len(missing)
+        if not missing or hunters_col is None: return
+        try: docs = await asyncio.to_thread(lambda: list(hunters_col.find({"_id": {"$in": missing}})))
+        except Exception as e:
+            logging.error(f"❌ Hunter Load Error: {e}")
+            return
+        for doc in docs:
+            if doc["_id"] not in self.records:
+                self.stats["loads"] += 1
+                self[doc["_id"]] = Hunter.from_doc(doc)
+        self.stats["misses"] += len(missing) - len(docs)
+
+    async def all_ids(self):
+        ids = set(self.records)
+        if hunters_col is not None:
+            try: ids.update(await asyncio.to_thread(lambda: [d["_id"] for d in hunters_col.find({}, {"_id": 1})]))
+            except Exception as e: logging.error(f"❌ Hunter Scan Error: {e}")
+        return list(ids)
+
+    def evict(self):
+        # Without a database the store is the only copy, so never drop anything
+        excess = len(self.records) - self.capacity
+        if hunters_col is None or excess <= 0: return
+        pinned = pending_writes["hunters"]
+        victims = []
+        for uid in self.records:
+            if uid not in pinned and uid != OWNER_ID:
+                victims.append(uid)
+                if len(victims) >= excess: break
+        for uid in victims: index_username(uid, self.records.pop(uid).username, "")
+        self.stats["evictions"] += len(victims)
+
+hunter_db = HunterStore(HUNTER_CACHE_SIZE)
+
+# ----------------- LEADERBOARDS -----------------
+# Each board is a sorted list of (-exp, uid) updated on every EXP change, trimmed
+# to LEADERBOARD_CAP entries. A trimmed hunter re-enters as soon as their EXP
+# changes, so the top 10 stays exact unless hundreds of ranked hunters all drop
+# below them at once. Rendered text is cached until the top 10 changes.
+LEADERBOARD_CAP = int(os.environ.get("LEADERBOARD_CAP", "500"))
+LEADERBOARD_TOP = 10
+
+class Leaderboard:
+    def __init__(self, cap=LEADERBOARD_CAP):
+        self.cap = cap
+        self.keys = []
+        self.exps = {}
+        self.text = None
+        self.version = 0
+
+    def _invalidate(self):
+        self.text = None
+        self.version += 1
+
+    def update(self, uid, exp):
+        old = self.exps.get(uid)
+        if old == exp: return
+        if old is not None:
+            i = bisect_left(self.keys, (-old, uid))
+            del self.keys[i]
+            del self.exps[uid]
+            if i < LEADERBOARD_TOP: self._invalidate()
+        key = (-exp, uid)
+        if len(self.keys) >= self.cap and key > self.keys[-1]: return
+        j = bisect_left(self.keys, key)
+        self.keys.insert(j, key)
+        self.exps[uid] = exp
+        if j < LEADERBOARD_TOP: self._invalidate()
+        if len(self.keys) > self.cap: del self.exps[self.keys.pop()[1]]
+
+    def touch(self, uid):
+        if uid in self.exps and bisect_left(self.keys, (-self.exps[uid], uid)) < LEADERBOARD_TOP: self._invalidate()
+
+    def top(self):
+        return [uid for _, uid in self.keys[:LEADERBOARD_TOP]]
+
+class LeaderboardIndex:
+    def __init__(self):
+        self.world = Leaderboard()
+        self.guilds = {}
+        self.member_guilds = defaultdict(set)
+
+    def on_exp(self, hunter):
+        self.world.update(hunter.uid, hunter.exp)
+        for cid in self.member_guilds.get(hunter.uid, ()): self.guilds[cid].update(hunter.uid, hunter.exp)
+
+    def join(self, chat_id, hunter):
+        if chat_id in self.member_guilds[hunter.uid]: return
+        self.member_guilds[hunter.uid].add(chat_id)
+        if chat_id not in self.guilds: self.guilds[chat_id] = Leaderboard()
+        self.guilds[chat_id].update(hunter.uid, hunter.exp)
+
+    def touch(self, uid):
+        self.world.touch(uid)
+        for cid in self.member_guilds.get(uid, ()): self.guilds[cid].touch(uid)
+
+leaderboards = LeaderboardIndex()
+
+# ----------------- USERNAME INDEX -----------------
+# "@name" (lowercased) -> user id, filled only from live data: a hunter's own
+# messages, the username_lc query and get_chat. A stored doc may carry a handle
+# its owner has since given up, so loading hunters never writes here. Entries go
+# with their hunter's eviction and the index is capped; failed lookups are
+# remembered briefly so repeated /ban @name never touches the Bot API.
+USERNAME_CACHE_TTL = int(os.environ.get("USERNAME_CACHE_TTL", "600"))
+USERNAME_INDEX_SIZE = int(os.environ.get("USERNAME_INDEX_SIZE", str(HUNTER_CACHE_SIZE)))
+
+username_index = {}
+unresolved_usernames = {}
+
+def index_username(user_id, old, new):
+    if old and username_index.get(old.lower()) == user_id: del username_index[old.lower()]
+    if new:
+        username_index.pop(new.lower(), None)
+        username_index[new.lower()] = user_id
+        unresolved_usernames.pop(new.lower(), None)
+        if len(username_index) > USERNAME_INDEX_SIZE: del username_index[next(iter(username_index))]
+
+# ----------------- ADMIN ROSTERS -----------------
+# Each group's administrators, seeded once from get_chat_administrators and then
+# patched by chat_member updates as people are promoted, demoted or leave. The
+# TTL only covers changes Telegram never delivered (downtime, bot not admin).
+ADMIN_ROSTER_TTL = int(os.environ.get("ADMIN_ROSTER_TTL", "1800"))
+# chat_member is opt-in on getUpdates/setWebhook; reactions stay off, nothing reads them
+ALLOWED_UPDATES = [t for t in Update.ALL_TYPES if t not in (Update.MESSAGE_REACTION, Update.MESSAGE_REACTION_COUNT)]
+
+class AdminRosters:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.chats = {}
+        self.seeding = {}
+        self.changed = set()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "updates": 0, "errors": 0}
+
+    async def roster(self, bot, chat_id):
+        entry = self.chats.get(chat_id)
+        if entry and entry[0] > time.time():
+            self.stats["hits"] += 1
+            return entry[1]
+        # Concurrent misses for one chat share a single get_chat_administrators
+        task = self.seeding.get(chat_id)
+        if task is None:
+            self.stats["misses"] += 1
+            task = self.seeding[chat_id] = asyncio.ensure_future(self._seed(bot, chat_id))
+        else: self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _seed(self, bot, chat_id):
+        self.changed.discard(chat_id)
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.seeding.pop(chat_id, None)
+        members = {m.user.id: m for m in admins}
+        # A promotion that arrived mid-fetch may be missing from this list, so
+        # use it once and fetch again on the next lookup
+        self.chats[chat_id] = (0 if chat_id in self.changed else time.time() + self.ttl, members)
+        return members
+
+    async def member(self, bot, chat_id, user_id):
+        return (await self.roster(bot, chat_id)).get(user_id)
+
+    async def usernames(self, bot, chat_id):
+        return {f"@{m.user.username.lower()}": uid for uid, m in (await self.roster(bot, chat_id)).items() if m.user.username}
+
+    def apply(self, chat_id, member):
+        self.stats["updates"] += 1
+        if chat_id in self.seeding: self.changed.add(chat_id)
+        entry = self.chats.get(chat_id)
+        if entry is None: return
+        if member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER): entry[1][member.user.id] = member
+        else: entry[1].pop(member.user.id, None)
+
+    def status_lines(self):
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        rate = f"{(lookups - self.stats['misses']) / lookups * 100:.1f}%" if lookups else "n/a"
+        return [
+            f"<b>Chats:</b> {len(self.chats)} | <b>Admins:</b> {sum(len(m) for _, m in self.chats.values())}",
+            f"<b>Hit Rate:</b> {rate} ({self.stats['hits']} hits / {self.stats['coalesced']} joined a fetch / {self.stats['misses']} fetches) | <b>Member Updates:</b> {self.stats['updates']} | <b>Errors:</b> {self.stats['errors']}"
+        ]
+
+admin_rosters = AdminRosters(ADMIN_ROSTER_TTL)
+
+async def track_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    change = update.chat_member
+    admin_rosters.apply(change.chat.id, change.new_chat_member)
+
+# ----------------- CHAT INFO CACHE -----------------
+# get_chat results (bios, group descriptions) by id. Fresh entries answer
+# outright; up to CHAT_INFO_STALE past their TTL they still answer while one
+# background fetch refreshes them. "Chat not found"-style failures are kept
+# briefly too, so /id on a user the bot can't see doesn't retry every time.
+CHAT_INFO_TTL = int(os.environ.get("CHAT_INFO_TTL", "600"))
+CHAT_INFO_STALE = int(os.environ.get("CHAT_INFO_STALE", "3600"))
+CHAT_INFO_ERROR_TTL = int(os.environ.get("CHAT_INFO_ERROR_TTL", "60"))
+CHAT_INFO_CACHE_SIZE = int(os.environ.get("CHAT_INFO_CACHE_SIZE", "2000"))
+
+class ChatInfoCache:
+    def __init__(self, capacity, ttl, stale, error_ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.stale = stale
+        self.error_ttl = error_ttl
+        self.entries = OrderedDict()
+        self.fetching = {}
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    async def get(self, bot, chat_id):
+        entry = self.entries.get(chat_id)
+        if entry:
+            fetched, result = entry
+            age = time.monotonic() - fetched
+            failed = isinstance(result, Exception)
+            if age < (self.error_ttl if failed else self.ttl):
+                self.stats["hits"] += 1
+                self.entries.move_to_end(chat_id)
+                if failed: raise result
+                return result
+            if not failed and age < self.ttl + self.stale:
+                self.stats["stale"] += 1
+                self.entries.move_to_end(chat_id)
+                if chat_id not in self.fetching: self._fetch(bot, chat_id)
+                return result
+        task = self.fetching.get(chat_id)
+        if task is None:
+            self.stats["misses"] += 1
+            task = self._fetch(bot, chat_id)
+        else: self.stats["coalesced"] += 1
+        result = await asyncio.shield(task)
+        if isinstance(result, Exception): raise result
+        return result
+
+    def _fetch(self, bot, chat_id):
+        task = self.fetching[chat_id] = spawn(self._load(bot, chat_id))
+        return task
+
+    async def _load(self, bot, chat_id):
+        # Returns the failure rather than raising it, so a background refresh
+        # nobody awaits doesn't leave an unretrieved task exception behind
+        try:
+            result = await bot.get_chat(chat_id)
+        except (BadRequest, Forbidden) as e:
+            self.stats["errors"] += 1
+            result = e
+        except Exception as e:
+            self.stats["errors"] += 1
+            return e
+        finally:
+            self.fetching.pop(chat_id, None)
+        self.entries[chat_id] = (time.monotonic(), result)
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.capacity: self.entries.popitem(last=False)
+        return result
+
+    def status_lines(self):
+        lookups = sum(self.stats[k] for k in ("hits", "stale", "misses", "coalesced"))
+        rate = f"{(lookups - self.stats['misses']) / lookups * 100:.1f}%" if lookups else "n/a"
+        return [
+            f"<b>Entries:</b> {len(self.entries)}/{self.capacity} | <b>TTL:</b> {self.ttl}s (+{self.stale}s stale) | <b>Refreshing:</b> {len(self.fetching)}",
+            f"<b>Hit Rate:</b> {rate} ({self.stats['hits']} fresh / {self.stats['stale']} stale / {self.stats['coalesced']} joined / {self.stats['misses']} fetched) | <b>Errors:</b> {self.stats['errors']}"
+        ]
+
+chat_info = ChatInfoCache(CHAT_INFO_CACHE_SIZE, CHAT_INFO_TTL, CHAT_INFO_STALE, CHAT_INFO_ERROR_TTL)
+
+# ----------------- TEXT MATCHERS -----------------
+# Word lists are folded into a prefix trie and compiled into one regex, so a
+# message is scanned once no matter how many words a chat has configured.
+def _trie_pattern(node):
+    if "" in node: return ""
+    alts = []
+    for ch, child in sorted(node.items()):
+        chunk = re.escape(ch)
+        while len(child) == 1 and "" not in child:
+            (ch, child), = child.items()
+            chunk += re.escape(ch)
+        alts.append(chunk + _trie_pattern(child))
+    return alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+
+def compile_words(words):
+    if not words: return None
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word: node = node.setdefault(ch, {})
+        node[""] = {}
+    return re.compile(_trie_pattern(trie))
+
+blacklist_matchers = {}
+
+def rebuild_blacklist(chat_id):
+    blacklist_matchers[chat_id] = compile_words(blacklist_db[chat_id])
+
+def blacklist_hit(chat_id, text):
+    matcher = blacklist_matchers.get(chat_id)
+    return matcher is not None and matcher.search(text) is not None
+
+# Filter keywords and the bot's username share one matcher per chat; the second
+# variant (with the username) is used when the message carries a mention entity.
+trigger_matchers = {}
+
+def rebuild_triggers(chat_id, bot_un):
+    keys = list(filters_db[chat_id])
+    trigger_matchers[chat_id] = (bot_un, compile_words(keys), compile_words(keys + [bot_un]))
+
+def trigger_hit(chat_id, text, bot_un, has_mention):
+    cached = trigger_matchers.get(chat_id)
+    if cached is None or cached[0] != bot_un:
+        rebuild_triggers(chat_id, bot_un)
+        cached = trigger_matchers[chat_id]
+    matcher = cached[2] if has_mention else cached[1]
+    return matcher is not None and matcher.search(text) is not None
+
+# ----------------- METRICS -----------------
+class RollingWindow:
+    # Keeps the most recent samples so percentiles track current behaviour
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, pct):
+        if not self.samples: return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def summary(self):
+        return {"count": len(self.samples), "p50": round(self.percentile(50), 1), "p95": round(self.percentile(95), 1), "p99": round(self.percentile(99), 1)}
+
+# ----------------- KEYED LOCKS -----------------
+# Updates run concurrently, so anything that checks state, awaits, and then
+# writes holds a lock for what it touches: ("dungeon", chat), ("pvp", id),
+# ("hunter", user). Unrelated chats never share a key and run in parallel.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {}
+        self.stats = {"acquired": 0, "contended": 0}
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        # A fixed order means two updates wanting the same pair of hunters
+        # can't each grab one and wait on the other
+        keys = sorted({key for key in keys if key is not None}, key=repr)
+        entries = []
+        for key in keys:
+            entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            entries.append((key, entry))
+        taken = []
+        try:
+            for key, entry in entries:
+                if entry[0].locked(): self.stats["contended"] += 1
+                await entry[0].acquire()
+                taken.append(entry[0])
+            self.stats["acquired"] += 1
+            yield
+        finally:
+            for lock in reversed(taken): lock.release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0: del self.locks[key]
+
+keyed_locks = KeyedLocks()
+
 # ----------------- MONGODB SETUP -----------------
 try:
     if MONGO_URI:
@@ -209,48 +758,377 @@ try:
         hunters_col = db["hunters"]
         groups_col = db["groups"]
         admins_col = db["admins"]
+        broadcasts_col = db["broadcasts"]
+        blocked_col = db["blocked_chats"]
 
         db_admins = admins_col.find_one({"_id": "admin_list"})
         if db_admins: admins_db.update(db_admins.get("ids", []))
 
         for grp in groups_col.find(): known_groups[grp["_id"]] = grp["title"]
-
-        for hnt in hunters_col.find():
-            hunter_db[hnt["_id"]] = {
-                "name": hnt.get("name", "Unknown"),
-                "username": hnt.get("username", ""),
-                "exp": hnt.get("exp", 0),
-                "last_hunt": hnt.get("last_hunt", 0),
-                "last_daily": hnt.get("last_daily", ""),
-                "crystals": hnt.get("crystals", 0),
-                "streak": hnt.get("streak", 0),
-                "loot_boxes": hnt.get("loot_boxes", 0),
-                "shadows": hnt.get("shadows", []),
-                "title": hnt.get("title", "")
-            }
-        logging.info("✅ MongoDB Connected & Permanent Data Loaded!")
+        blocked_chats.update(doc["_id"] for doc in blocked_col.find({}, {"_id": 1}))
+
+        hunters_col.create_index([("exp", -1)])
+        hunters_col.create_index("username_lc")
+        # One-off backfill for docs saved before username_lc existed, done server-side
+        # so @name lookups only ever query the indexed field; a no-op once it has run
+        backfilled = hunters_col.update_many({"username_lc": {"$exists": False}}, [{"$set": {"username_lc": {"$toLower": {"$ifNull": ["$username", ""]}}}}])
+        if backfilled.modified_count: logging.info(f"✅ Backfilled username_lc on {backfilled.modified_count} hunters.")
+        for hnt in hunters_col.find({}, {"exp": 1}).sort("exp", -1).limit(LEADERBOARD_CAP): leaderboards.world.update(hnt["_id"], hnt.get("exp", 0))
+        logging.info("✅ MongoDB Connected! Hunters will load on demand.")
     else:
         logging.warning("⚠️ MONGO_URI not found. Using temporary RAM memory.")
-        hunters_col = groups_col = admins_col = None
+        hunters_col = groups_col = admins_col = broadcasts_col = blocked_col = None
 except Exception as e:
     logging.error(f"❌ MongoDB Connection Error: {e}")
-    hunters_col = groups_col = admins_col = None
+    hunters_col = groups_col = admins_col = broadcasts_col = blocked_col = None
+
+# ----------------- WRITE-BEHIND PERSISTENCE -----------------
+# Handlers only mark records dirty; a background flush coalesces them into one
+# bulk_write per collection and runs it off the event loop.
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "0.5"))
+FLUSH_BATCH = int(os.environ.get("FLUSH_BATCH", "200"))
+
+pending_writes = {"hunters": set(), "groups": {}, "admins": False}
+persist_stats = {"flushes": 0, "docs": 0, "coalesced": 0, "errors": 0, "latency": RollingWindow()}
+flush_lock = asyncio.Lock()
+# Set when a flush task is spawned, cleared once it takes its snapshot: saves made
+# before then ride along with it instead of spawning flushes of their own
+flush_state = {"scheduled": False}
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def pending_count():
+    return len(pending_writes["hunters"]) + len(pending_writes["groups"]) + int(pending_writes["admins"])
+
+def _request_flush():
+    if pending_count() < FLUSH_BATCH or flush_state["scheduled"]: return
+    try: spawn(flush_pending())
+    except RuntimeError: return
+    flush_state["scheduled"] = True
 
 def save_hunter(user_id):
     if hunters_col is not None and user_id in hunter_db:
-        data = hunter_db[user_id].copy()
-        try: hunters_col.update_one({"_id": user_id}, {"$set": data}, upsert=True)
-        except: pass
+        if user_id in pending_writes["hunters"]: persist_stats["coalesced"] += 1
+        else: pending_writes["hunters"].add(user_id)
+        _request_flush()
 
 def save_group(chat_id, title):
     if groups_col is not None:
-        try: groups_col.update_one({"_id": chat_id}, {"$set": {"title": title}}, upsert=True)
-        except: pass
+        if chat_id in pending_writes["groups"]: persist_stats["coalesced"] += 1
+        pending_writes["groups"][chat_id] = title
+        _request_flush()
 
 def save_admins():
     if admins_col is not None:
-        try: admins_col.update_one({"_id": "admin_list"}, {"$set": {"ids": list(admins_db)}}, upsert=True)
+        pending_writes["admins"] = True
+        _request_flush()
+
+def _write_batch(hunter_ops, group_ops, admin_ids):
+    if hunter_ops: hunters_col.bulk_write(hunter_ops, ordered=False)
+    if group_ops: groups_col.bulk_write(group_ops, ordered=False)
+    if admin_ids is not None: admins_col.update_one({"_id": "admin_list"}, {"$set": {"ids": admin_ids}}, upsert=True)
+
+async def flush_pending():
+    async with flush_lock:
+        flush_state["scheduled"] = False
+        hunters, groups, admins = pending_writes["hunters"], pending_writes["groups"], pending_writes["admins"]
+        if not (hunters or groups or admins): return
+        pending_writes.update({"hunters": set(), "groups": {}, "admins": False})
+
+        # Snapshot on the loop so the worker thread never sees a half-updated record
+        hunter_ops = [UpdateOne({"_id": uid}, {"$set": hunter_db.records[uid].to_doc()}, upsert=True) for uid in hunters if uid in hunter_db]
+        group_ops = [UpdateOne({"_id": cid}, {"$set": {"title": title}}, upsert=True) for cid, title in groups.items()]
+        admin_ids = list(admins_db) if admins else None
+
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(_write_batch, hunter_ops, group_ops, admin_ids)
+        except Exception as e:
+            logging.error(f"❌ MongoDB Flush Error: {e}")
+            persist_stats["errors"] += 1
+            pending_writes["hunters"] |= hunters
+            for cid, title in groups.items(): pending_writes["groups"].setdefault(cid, title)
+            pending_writes["admins"] = pending_writes["admins"] or admins
+            return
+        persist_stats["latency"].add((time.perf_counter() - start) * 1000)
+        persist_stats["flushes"] += 1
+        persist_stats["docs"] += len(hunter_ops) + len(group_ops) + (admin_ids is not None)
+        hunter_db.evict()
+
+async def flush_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush_pending()
+
+# ----------------- HTTP CLIENTS -----------------
+# One keep-alive client per upstream for the whole process lifetime, opened in
+# post_init and closed on shutdown, instead of a fresh TCP+TLS handshake per call.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2 = os.environ.get("HTTP2", "0") == "1"
+
+HTTP_HOSTS = {
+    "openrouter": {"base_url": "https://openrouter.ai/api/v1", "timeout": 6},
+    "jikan": {"base_url": "https://api.jikan.moe/v4", "timeout": 10},
+    "default": {"timeout": 10},
+}
+http_clients = {}
+http_stats = defaultdict(lambda: {"requests": 0, "errors": 0, "inflight": 0, "latency": RollingWindow()})
+
+def http_client(name):
+    if name not in http_clients:
+        http2 = HTTP2 and importlib.util.find_spec("h2") is not None
+        if HTTP2 and not http2: logging.warning("⚠️ HTTP2=1 but the 'h2' package is missing, using HTTP/1.1.")
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+        http_clients[name] = httpx.AsyncClient(http2=http2, limits=limits, **HTTP_HOSTS[name])
+    return http_clients[name]
+
+async def close_http_clients():
+    for client in http_clients.values():
+        try: await client.aclose()
         except: pass
+    http_clients.clear()
+
+def http_pool_size(name):
+    pool = getattr(getattr(http_clients.get(name), "_transport", None), "_pool", None)
+    return len(getattr(pool, "connections", ()))
+
+async def http_request(name, method, url, stream=False, **kwargs):
+    # With stream=True the body is left unread; the caller must aclose() it
+    stats = http_stats[name]
+    stats["inflight"] += 1
+    start = time.perf_counter()
+    try:
+        client = http_client(name)
+        return await client.send(client.build_request(method, url, **kwargs), stream=stream)
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        stats["inflight"] -= 1
+        stats["requests"] += 1
+        stats["latency"].add((time.perf_counter() - start) * 1000)
+
+async def on_startup(application):
+    for name in HTTP_HOSTS: http_client(name)
+    await resume_broadcast(application)
+
+async def on_shutdown(application):
+    await flush_pending()
+    if pending_count(): logging.error(f"❌ {pending_count()} records could not be saved on shutdown!")
+    await close_http_clients()
+
+# ----------------- CHAT ACTIONS -----------------
+# One "typing..." ticker per chat, shared by everything slow running there (AI
+# replies, /anime, welcome cards). Holders are reference-counted; the ticker
+# stops with the last one and never sends twice within CHAT_ACTION_INTERVAL.
+CHAT_ACTION_INTERVAL = float(os.environ.get("CHAT_ACTION_INTERVAL", "4.5"))
+
+class ChatActionTicker:
+    def __init__(self, interval):
+        self.interval = interval
+        self.chats = {}
+        self.last_sent = {}
+        self.stats = {"sent": 0, "shared": 0}
+
+    async def _tick(self, bot, chat_id, action):
+        while True:
+            wait = self.last_sent.get(chat_id, 0) + self.interval - time.monotonic()
+            if wait > 0: await asyncio.sleep(wait)
+            self.last_sent[chat_id] = time.monotonic()
+            self.stats["sent"] += 1
+            try: await bot.send_chat_action(chat_id=chat_id, action=action)
+            except Exception: pass
+
+    @asynccontextmanager
+    async def hold(self, bot, chat_id, action=ChatAction.TYPING):
+        entry = self.chats.get(chat_id)
+        if entry:
+            entry["refs"] += 1
+            self.stats["shared"] += 1
+        else:
+            entry = self.chats[chat_id] = {"refs": 1, "task": asyncio.create_task(self._tick(bot, chat_id, action))}
+        try:
+            yield
+        finally:
+            entry["refs"] -= 1
+            if not entry["refs"]:
+                entry["task"].cancel()
+                del self.chats[chat_id]
+                if len(self.last_sent) > 5000:
+                    cutoff = time.monotonic() - self.interval
+                    self.last_sent = {cid: t for cid, t in self.last_sent.items() if t > cutoff}
+
+typing_ticker = ChatActionTicker(CHAT_ACTION_INTERVAL)
+
+# ----------------- DEFERRED ACTIONS -----------------
+# Timed effects (a duel's result landing, a purge ack disappearing) are handed to
+# the job queue, so the handler returns once the real work is done.
+deferred_stats = {"scheduled": 0, "done": 0, "failed": 0}
+
+async def _run_deferred(context, method, kwargs):
+    try:
+        await getattr(context.bot, method)(**kwargs)
+        deferred_stats["done"] += 1
+    except RetryAfter as e:
+        defer(context, e.retry_after, method, **kwargs)
+    except Exception as e:
+        deferred_stats["failed"] += 1
+        logging.warning(f"Deferred {method} failed: {e}")
+
+async def deferred_job(context: ContextTypes.DEFAULT_TYPE):
+    await _run_deferred(context, *context.job.data)
+
+async def _deferred_task(context, delay, method, kwargs):
+    await asyncio.sleep(delay)
+    await _run_deferred(context, method, kwargs)
+
+def defer(context, delay, method, **kwargs):
+    deferred_stats["scheduled"] += 1
+    if context.job_queue: context.job_queue.run_once(deferred_job, delay, data=(method, kwargs))
+    else: spawn(_deferred_task(context, delay, method, kwargs))
+
+def defer_edit(context, delay, chat_id, message_id, text, **kwargs):
+    defer(context, delay, "edit_message_text", chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+
+def defer_delete(context, delay, chat_id, message_id):
+    defer(context, delay, "delete_message", chat_id=chat_id, message_id=message_id)
+
+# ----------------- BROADCAST -----------------
+# Broadcasts run as one background job: groups first, then hunters' DMs, each in
+# ascending id order. Sends share a token bucket (BROADCAST_RATE msg/s, under the
+# Bot API's ~30/s) with at most BROADCAST_CONCURRENCY in flight, and a RetryAfter
+# pauses the whole bucket. After every chunk the cursor is saved to Mongo, so a
+# restart resumes where it stopped (at most one chunk is sent twice). Chats
+# that blocked or removed the bot are remembered and skipped next time.
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_CHUNK = int(os.environ.get("BROADCAST_CHUNK", "100"))
+BROADCAST_PHASES = ("groups", "users")
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+broadcast_bucket = TokenBucket(BROADCAST_RATE, 1)
+broadcast_state = {"job": None, "task": None}
+
+def new_broadcast(text, by):
+    return {"_id": "active", "text": text, "by": by, "phase": BROADCAST_PHASES[0], "last": None, "total": 0, "done": 0,
+            "sent": {"groups": 0, "users": 0}, "failed": 0, "blocked": 0, "skipped": 0, "retries": 0, "started": time.time()}
+
+async def save_broadcast(job):
+    if broadcasts_col is None: return
+    try:
+        if job is None: await asyncio.to_thread(broadcasts_col.delete_one, {"_id": "active"})
+        else: await asyncio.to_thread(broadcasts_col.replace_one, {"_id": "active"}, {**job, "sent": dict(job["sent"])}, upsert=True)
+    except Exception as e: logging.error(f"❌ Broadcast checkpoint failed: {e}")
+
+async def block_chats(chat_ids):
+    blocked_chats.update(chat_ids)
+    if blocked_col is None or not chat_ids: return
+    try: await asyncio.to_thread(blocked_col.bulk_write, [UpdateOne({"_id": cid}, {"$set": {"at": time.time()}}, upsert=True) for cid in chat_ids], ordered=False)
+    except Exception as e: logging.error(f"❌ Saving blocked chats failed: {e}")
+
+def unblock_chat(chat_id):
+    # The chat talked to us again, so it's reachable after all
+    blocked_chats.discard(chat_id)
+    if blocked_col is not None: spawn(asyncio.to_thread(blocked_col.delete_one, {"_id": chat_id}))
+
+async def _broadcast_one(bot, job, chat_id, text, newly_blocked):
+    for _ in range(3):
+        await broadcast_bucket.take()
+        try:
+            await bot.send_message(chat_id, text, parse_mode="HTML")
+            job["sent"][job["phase"]] += 1
+            return
+        except RetryAfter as e:
+            broadcast_bucket.pause(e.retry_after)
+            job["retries"] += 1
+        except Forbidden:
+            newly_blocked.append(chat_id)
+            job["blocked"] += 1
+            return
+        except Exception:
+            break
+    job["failed"] += 1
+
+async def run_broadcast(bot, job):
+    texts = {"groups": premium(f"<b>📢 Broadcast Message:</b>\n\n{job['text']} ✨"), "users": premium(f"<b>📢 System Broadcast:</b>\n\n{job['text']} 🌸")}
+    limit = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(chat_id, text, newly_blocked):
+        async with limit: await _broadcast_one(bot, job, chat_id, text, newly_blocked)
+
+    try:
+        for phase in BROADCAST_PHASES[BROADCAST_PHASES.index(job["phase"]):]:
+            targets = sorted(known_groups) if phase == "groups" else sorted(await hunter_db.all_ids())
+            if job["last"] is not None: targets = targets[bisect_left(targets, job["last"] + 1):]
+            job["phase"] = phase
+            job["total"] = job["done"] + len(targets)
+            for i in range(0, len(targets), BROADCAST_CHUNK):
+                chunk = targets[i:i + BROADCAST_CHUNK]
+                newly_blocked = []
+                reachable = [cid for cid in chunk if cid not in blocked_chats]
+                job["skipped"] += len(chunk) - len(reachable)
+                await asyncio.gather(*(send(cid, texts[phase], newly_blocked) for cid in reachable))
+                await block_chats(newly_blocked)
+                job["done"] += len(chunk)
+                job["last"] = chunk[-1]
+                await save_broadcast(job)
+            job.update({"last": None, "done": 0})
+        await save_broadcast(None)
+        summary = f"<b>✅ Broadcast successfully sent to {job['sent']['groups']} Groups and {job['sent']['users']} Users DMs!</b> 🎉\n<b>Blocked:</b> {job['blocked']} | <b>Skipped:</b> {job['skipped']} | <b>Failed:</b> {job['failed']} | <b>Took:</b> {int(time.time() - job['started'])}s"
+        try: await bot.send_message(job["by"], premium(summary), parse_mode="HTML")
+        except Exception: pass
+    finally:
+        broadcast_state.update({"job": None, "task": None})
+
+def start_broadcast(bot, job):
+    broadcast_state.update({"job": job, "task": spawn(run_broadcast(bot, job))})
+
+async def resume_broadcast(application):
+    if broadcasts_col is None: return
+    try: job = await asyncio.to_thread(broadcasts_col.find_one, {"_id": "active"})
+    except Exception: return
+    if job:
+        logging.info(f"📢 Resuming broadcast at {job['phase']} #{job['done']}")
+        start_broadcast(application.bot, job)
+
+def broadcast_status_lines():
+    job = broadcast_state["job"]
+    if not job: return ["<b>Idle</b>"]
+    elapsed = max(1.0, time.time() - job["started"])
+    sent = job["sent"]["groups"] + job["sent"]["users"]
+    rate = sent / elapsed
+    eta = (job["total"] - job["done"]) / rate if rate else 0
+    return [f"<b>Phase:</b> {job['phase']} {job['done']}/{job['total']} | <b>ETA:</b> {int(eta)}s",
+            f"<b>Sent:</b> {job['sent']['groups']} groups, {job['sent']['users']} users | {rate:.1f}/s",
+            f"<b>Blocked:</b> {job['blocked']} | <b>Skipped:</b> {job['skipped']} | <b>Failed:</b> {job['failed']} | <b>Retries:</b> {job['retries']}"]
 
 def _display_name(user):
     return str(getattr(user, "first_name", None) or getattr(user, "username", None) or "User")
@@ -267,24 +1145,30 @@ async def get_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             return int(arg)
         search_arg = arg if arg.startswith('@') else f"@{arg}"
         search_arg_lower = search_arg.lower()
-        for uid, data in hunter_db.items():
-            uname = data.get("username", "")
-            if uname and uname.lower() == search_arg_lower:
-                return uid
-        try:
-            admins = await context.bot.get_chat_administrators(update.effective_chat.id)
-            for admin in admins:
-                if admin.user.username and f"@{admin.user.username.lower()}" == search_arg_lower:
-                    return admin.user.id
-        except: pass
+        if search_arg_lower in username_index: return username_index[search_arg_lower]
         if update.message.entities:
             for entity in update.message.entities:
                 if entity.type == 'text_mention' and entity.user:
                     return entity.user.id
+        if unresolved_usernames.get(search_arg_lower, 0) > time.time(): return None
+        try:
+            admins = await admin_rosters.usernames(context.bot, update.effective_chat.id)
+            if search_arg_lower in admins: return admins[search_arg_lower]
+        except: pass
+        if hunters_col is not None:
+            try:
+                doc = await asyncio.to_thread(hunters_col.find_one, {"username_lc": search_arg_lower}, {"_id": 1})
+                if doc:
+                    index_username(doc["_id"], "", search_arg_lower)
+                    return doc["_id"]
+            except: pass
         try: 
             chat = await context.bot.get_chat(search_arg)
+            index_username(chat.id, "", search_arg_lower)
             return chat.id
         except: 
+            if len(unresolved_usernames) > 5000: unresolved_usernames.clear()
+            unresolved_usernames[search_arg_lower] = time.time() + USERNAME_CACHE_TTL
             return None
     return None
 
@@ -293,7 +1177,7 @@ async def check_rights(update: Update, action: str) -> bool:
     if user.id in admins_db: return True 
     if chat.type == "private": return False
     try:
-        member = await chat.get_member(user.id)
+        member = await admin_rosters.member(update.get_bot(), chat.id, user.id)
         if isinstance(member, ChatMemberOwner): return True
         if isinstance(member, ChatMemberAdministrator):
             if action in ["ban", "kick", "mute", "unban", "unmute", "warn", "unwarn"]: return member.can_restrict_members
@@ -303,33 +1187,40 @@ async def check_rights(update: Update, action: str) -> bool:
         return False
     except: return False
 
-def ensure_user_registered(update: Update):
+async def ensure_user_registered(update: Update):
     user, chat = update.effective_user, update.effective_chat
     if not user: return
     username = f"@{user.username}" if user.username else ""
-    if user.id not in hunter_db:
-        hunter_db[user.id] = {"name": _display_name(user), "username": username, "exp": 0, "last_hunt": 0, "last_daily": "", "crystals": 0, "streak": 0, "loot_boxes": 0, "shadows": [], "title": ""}
-    
-    for key, val in [("crystals", 0), ("streak", 0), ("loot_boxes", 0), ("shadows", []), ("title", "")]:
-        if key not in hunter_db[user.id]: hunter_db[user.id][key] = val
-
-    hunter_db[user.id]["name"] = _display_name(user)
-    hunter_db[user.id]["username"] = username
+    hunter = await hunter_db.ensure(user.id, _display_name(user), username)
+    index_username(user.id, hunter.username, username)
+    if hunter.name != _display_name(user) or hunter.username != username:
+        hunter.name, hunter.username = _display_name(user), username
+        leaderboards.touch(user.id)
     
-    if user.id == OWNER_ID: 
-        hunter_db[user.id]["exp"] = 9999999
-        hunter_db[user.id]["crystals"] = 9999999
-        hunter_db[user.id]["loot_boxes"] = 9999
-        hunter_db[user.id]["shadows"] = ALL_SHADOWS.copy()
+    if user.id == OWNER_ID: hunter_db[user.id].make_owner()
         
     if chat and chat.type in ["group", "supergroup"]:
         chat_members_db[chat.id].add(user.id)
+        leaderboards.join(chat.id, hunter)
         if chat.title and (chat.id not in known_groups or known_groups[chat.id] != chat.title):
             known_groups[chat.id] = chat.title
             save_group(chat.id, chat.title)
 
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    # Commands and buttons let HunterStoreError escape rather than act on a hunter
+    # they couldn't load; the user still gets an answer instead of silence
+    if isinstance(context.error, HunterStoreError):
+        logging.warning(f"⚠️ Hunter data unavailable for {context.error}")
+        if isinstance(update, Update):
+            try:
+                if update.callback_query: await update.callback_query.answer("Hunter data unavailable, try again!", show_alert=True)
+                elif update.effective_message: await update.effective_message.reply_text(premium_static("<b>❌ Hunter data unavailable, try again!</b> ⚠️"), parse_mode="HTML")
+            except TelegramError: pass
+        return
+    logging.error("Unhandled error while processing an update", exc_info=context.error)
+
 async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     chat = update.effective_chat
     sender = update.effective_user
     
@@ -342,7 +1233,7 @@ async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif context.args:
         target_id = await get_user_id(update, context)
         if not target_id:
-            return await update.message.reply_text(premium("<b>❌ System Error:</b> User not found! Reply to a message or check the username. ✨"), parse_mode="HTML")
+            return await update.message.reply_text(premium_static("<b>❌ System Error:</b> User not found! Reply to a message or check the username. ✨"), parse_mode="HTML")
     else:
         target_id = sender.id
         target_user_obj = sender
@@ -351,8 +1242,13 @@ async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     target_name = "Unknown Hunter"
     target_uname = "None"
 
+    # Both profiles are looked up at once, usually straight from the cache
+    lookups = [chat_info.get(context.bot, target_id)]
+    if chat.type != 'private': lookups.append(chat_info.get(context.bot, chat.id))
+    target_chat, *group_chat = await asyncio.gather(*lookups, return_exceptions=True)
+
     try:
-        target_chat = await context.bot.get_chat(target_id)
+        if isinstance(target_chat, Exception): raise target_chat
         target_bio = target_chat.bio if target_chat.bio else "No bio set."
         target_name = target_chat.first_name + (f" {target_chat.last_name}" if target_chat.last_name else "")
         target_uname = f"@{target_chat.username}" if target_chat.username else "None"
@@ -360,17 +1256,21 @@ async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if target_user_obj:
             target_name = _display_name(target_user_obj)
             target_uname = f"@{target_user_obj.username}" if target_user_obj.username else "None"
-        elif target_id in hunter_db:
-            target_name = hunter_db[target_id]["name"]
-            target_uname = hunter_db[target_id]["username"] or "None"
+        else:
+            # Hunters load on demand, so one who isn't resident is fetched first
+            try: hunter = await hunter_db.load(target_id)
+            except HunterStoreError: hunter = None
+            if hunter:
+                target_name = hunter.name
+                target_uname = hunter.username or "None"
 
     group_bio = "No description available."
     group_uname = "None"
     group_title = chat.title if chat.type != 'private' else 'Private Chat'
     
-    if chat.type != 'private':
+    if group_chat and not isinstance(group_chat[0], Exception):
         try:
-            group_chat = await context.bot.get_chat(chat.id)
+            group_chat = group_chat[0]
             group_bio = group_chat.description if group_chat.description else "No group bio set."
             group_uname = f"@{group_chat.username}" if group_chat.username else "None"
         except: pass
@@ -413,32 +1313,27 @@ def get_hunter_stats(exp, user_id=None):
     return level, rank
 
 async def hunter_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     target_user = update.message.reply_to_message.from_user if update.message.reply_to_message else update.effective_user
     username = f"@{target_user.username}" if target_user.username else ""
     
-    if target_user.id not in hunter_db:
-        hunter_db[target_user.id] = {"name": _display_name(target_user), "username": username, "exp": 0, "last_hunt": 0, "last_daily": "", "crystals": 0, "streak": 0, "loot_boxes": 0, "shadows": [], "title": ""}
+    try: await hunter_db.ensure(target_user.id, _display_name(target_user), username)
+    except HunterStoreError: return await update.message.reply_text(premium_static("<b>❌ Hunter data unavailable, try again!</b> ⚠️"), parse_mode="HTML")
     
-    if target_user.id == OWNER_ID: 
-        hunter_db[target_user.id]["exp"] = 9999999
-        hunter_db[target_user.id]["crystals"] = 9999999
-        hunter_db[target_user.id]["loot_boxes"] = 9999
-        hunter_db[target_user.id]["shadows"] = ALL_SHADOWS.copy()
+    if target_user.id == OWNER_ID: hunter_db[target_user.id].make_owner()
 
     data = hunter_db[target_user.id]
-    level, rank = get_hunter_stats(data["exp"], target_user.id)
-    uname_display = f" ({data['username']})" if data['username'] else ""
-    safe_name = str(data['name']).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-    title_disp = f"\n👑 <b>Title:</b> {data['title']}" if data.get("title") else ""
+    level, rank = get_hunter_stats(data.exp, target_user.id)
+    uname_display = f" ({data.username})" if data.username else ""
+    safe_name = str(data.name).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    title_disp = f"\n👑 <b>Title:</b> {data.title}" if data.title else ""
     
-    shadow_list = data.get("shadows", [])
-    shadows_count = len(shadow_list)
-    shadow_names = ", ".join(set(shadow_list)) if shadows_count > 0 else "None"
+    shadows_count = data.shadow_count()
+    shadow_names = ", ".join(data.shadow_names()) if shadows_count > 0 else "None"
     
-    exp_disp = data['exp'] if level != 'MAX' else '∞'
-    cryst_disp = data.get('crystals', 0) if level != 'MAX' else '∞'
-    loot_disp = data.get('loot_boxes', 0) if level != 'MAX' else '∞'
+    exp_disp = data.exp if level != 'MAX' else '∞'
+    cryst_disp = data.crystals if level != 'MAX' else '∞'
+    loot_disp = data.loot_boxes if level != 'MAX' else '∞'
     
     text = f"""🪪 <b>HUNTER LICENSE</b>
 
@@ -448,22 +1343,22 @@ async def hunter_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ⚡ <b>EXP:</b> {exp_disp}
 🔮 <b>Magic Crystals:</b> {cryst_disp}
 👥 <b>Shadow Soldiers:</b> {shadows_count} <i>({shadow_names})</i>
-🔥 <b>Daily Streak:</b> {data.get('streak', 0)} Days
+🔥 <b>Daily Streak:</b> {data.streak} Days
 🧰 <b>Loot Boxes:</b> {loot_disp}"""
 
     await update.message.reply_text(premium(text), parse_mode="HTML")
 
 async def hunt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     user, now = update.effective_user, time.time()
     data = hunter_db[user.id]
     
-    if now - data["last_hunt"] < 3600: 
-        m, s = divmod(int(3600 - (now - data["last_hunt"])), 60)
+    if now - data.last_hunt < 3600: 
+        m, s = divmod(int(3600 - (now - data.last_hunt)), 60)
         return await update.message.reply_text(premium(f"<b>⏳ Dungeon portal closed!</b>\nWait {m}m {s}s to hunt again. ✨"), parse_mode="HTML")
     
-    data["last_hunt"] = now
-    shadow_bonus = len(data.get("shadows", [])) * 5
+    data.last_hunt = now
+    shadow_bonus = data.shadow_count() * 5
 
     events = [
         ("🟢 E-Rank Gate: Defeated 5 Goblins!", 25, 2), 
@@ -478,75 +1373,75 @@ async def hunt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if exp_gain > 0: exp_gain += shadow_bonus
     
     if user.id != OWNER_ID: 
-        data["exp"] = max(0, data["exp"] + exp_gain)
-        data["crystals"] += cryst_gain
+        data.exp = max(0, data.exp + exp_gain)
+        data.crystals += cryst_gain
     
     save_hunter(user.id)
-    level, rank = get_hunter_stats(data["exp"], user.id)
+    level, rank = get_hunter_stats(data.exp, user.id)
     shadow_text = f" (Shadow Bonus: +{shadow_bonus})" if shadow_bonus > 0 and exp_gain > 0 else ""
-    text = f"<b>⛩️ Dungeon Raid Results:</b>\n\n{event} ✨\n⚡ <b>EXP:</b> {exp_gain}{shadow_text} | 🔮 <b>Crystals:</b> {cryst_gain}\n📊 <b>Total EXP:</b> {data['exp'] if level != 'MAX' else '∞'} | <b>Level:</b> {level}"
+    text = f"<b>⛩️ Dungeon Raid Results:</b>\n\n{event} ✨\n⚡ <b>EXP:</b> {exp_gain}{shadow_text} | 🔮 <b>Crystals:</b> {cryst_gain}\n📊 <b>Total EXP:</b> {data.exp if level != 'MAX' else '∞'} | <b>Level:</b> {level}"
     await update.message.reply_text(premium(text), parse_mode="HTML")
 
 async def daily_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     user = update.effective_user
     now_ist = dt.now(ZoneInfo("Asia/Kolkata"))
     today = str(now_ist.date() if now_ist.hour >= 1 else (now_ist - timedelta(days=1)).date())
     yesterday = str((now_ist - timedelta(days=1)).date() if now_ist.hour >= 1 else (now_ist - timedelta(days=2)).date())
     
     data = hunter_db[user.id]
-    if data["last_daily"] == today:
-        return await update.message.reply_text(premium("<b>⏳ Daily Quest already completed!</b> Next quest unlocks at 1:00 AM IST. 🌸"), parse_mode="HTML")
+    if data.last_daily == today:
+        return await update.message.reply_text(premium_static("<b>⏳ Daily Quest already completed!</b> Next quest unlocks at 1:00 AM IST. 🌸"), parse_mode="HTML")
         
-    if data["last_daily"] == yesterday: data["streak"] = data.get("streak", 0) + 1
-    else: data["streak"] = 1
+    if data.last_daily == yesterday: data.streak += 1
+    else: data.streak = 1
         
-    data["last_daily"] = today
+    data.last_daily = sys.intern(today)
     if user.id != OWNER_ID: 
-        data["exp"] += 150
-        data["crystals"] += 20
+        data.exp += 150
+        data.crystals += 20
         
-    streak_msg = f"🔥 <b>Streak:</b> Day {data['streak']}!"
-    if data["streak"] % 7 == 0:
-        data["loot_boxes"] += 1
+    streak_msg = f"🔥 <b>Streak:</b> Day {data.streak}!"
+    if data.streak % 7 == 0:
+        data.loot_boxes += 1
         streak_msg += "\n🎁 <b>7-DAY REWARD: You received an S-Rank Loot Box! (/open_box)</b>"
     
     save_hunter(user.id)
-    level, rank = get_hunter_stats(data["exp"], user.id)
+    level, rank = get_hunter_stats(data.exp, user.id)
     text = f"<b>🏋️‍♂️ Daily Quest Completed!</b>\n100 Pushups, 100 Situps, 10km Run! 💦\n\n🌟 +150 EXP | 🔮 +20 Crystals\n{streak_msg}\n📊 <b>Current Level:</b> {level}"
     await update.message.reply_text(premium(text), parse_mode="HTML")
 
 async def open_loot_box(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     user = update.effective_user
     data = hunter_db[user.id]
     
-    if data.get("loot_boxes", 0) <= 0 and user.id != OWNER_ID: 
-        return await update.message.reply_text(premium("<b>❌ You don't have any S-Rank Loot Boxes.</b> Complete a 7-day /daily streak to get one! ✨"), parse_mode="HTML")
+    if data.loot_boxes <= 0 and user.id != OWNER_ID: 
+        return await update.message.reply_text(premium_static("<b>❌ You don't have any S-Rank Loot Boxes.</b> Complete a 7-day /daily streak to get one! ✨"), parse_mode="HTML")
         
     if user.id != OWNER_ID:
-        data["loot_boxes"] -= 1
+        data.loot_boxes -= 1
         
     exp_win = random.randint(500, 2000)
     cryst_win = random.randint(50, 200)
     
     if user.id != OWNER_ID:
-        data["exp"] += exp_win
-        data["crystals"] += cryst_win
+        data.exp += exp_win
+        data.crystals += cryst_win
     save_hunter(user.id)
     
     text = f"<b>🧰 Opening S-Rank Loot Box...</b>\n\n✨ <b>JACKPOT!</b> ✨\nYou found <b>{exp_win} EXP</b> and <b>{cryst_win} Magic Crystals</b> 🔮!"
     await update.message.reply_text(premium(text), parse_mode="HTML")
 
 async def give_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     sender = update.effective_user
     
     if not update.message.reply_to_message: 
-        return await update.message.reply_text(premium("<b>❌ Reply to a Hunter's message</b> and type `/give` to send items. 🌸"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ Reply to a Hunter's message</b> and type `/give` to send items. 🌸"), parse_mode="HTML")
     target = update.message.reply_to_message.from_user
     if sender.id == target.id: 
-        return await update.message.reply_text(premium("<b>❌ You cannot give items to yourself!</b> 🤡"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ You cannot give items to yourself!</b> 🤡"), parse_mode="HTML")
         
     context.user_data["give_target_id"] = target.id
     context.user_data["give_target_name"] = _display_name(target)
@@ -568,22 +1463,23 @@ async def give_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data.pop("give_item", None)
         context.user_data.pop("awaiting_give_amount", None)
         context.user_data.pop("awaiting_give_shadow", None)
-        return await query.edit_message_text(premium("<b>❌ Transaction Cancelled.</b> ✨"), parse_mode="HTML")
+        return await query.edit_message_text(premium_static("<b>❌ Transaction Cancelled.</b> ✨"), parse_mode="HTML")
         
     target_id = context.user_data.get("give_target_id")
     if not target_id:
         return await query.answer("Session expired. Try /give again.", show_alert=True)
         
     target_name = context.user_data.get("give_target_name", "Hunter")
+    await ensure_user_registered(update)
     
     if action == "shadow":
-        s_shadows = hunter_db[user_id].get("shadows", [])
+        s_shadows = hunter_db[user_id].shadow_names()
         if user_id == OWNER_ID: s_shadows = ALL_SHADOWS
         
         if not s_shadows:
             return await query.answer("You don't have any Shadow Soldiers to give!", show_alert=True)
             
-        shadow_list = "\n".join([f"🌑 <code>{s}</code>" for s in set(s_shadows)])
+        shadow_list = "\n".join([f"🌑 <code>{s}</code>" for s in s_shadows])
         context.user_data["awaiting_give_shadow"] = True
         return await query.edit_message_text(premium(f"<b>👥 Your Shadow Soldiers:</b>\n{shadow_list}\n\n<i>Type the EXACT name of the Shadow you want to give to {target_name}:</i> ✨"), parse_mode="HTML")
 
@@ -593,47 +1489,45 @@ async def give_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await query.edit_message_text(premium(f"<b>🔢 How much {item_names[action]} do you want to give to {target_name}?</b>\n\n<i>Type the number in the chat now:</i> 🌸"), parse_mode="HTML")
 
+async def render_leaderboard(board, header):
+    while board.text is None:
+        version, top = board.version, board.top()
+        await hunter_db.load_many(top)
+        text = header
+        for i, uid in enumerate([uid for uid in top if uid in hunter_db], 1):
+            h = hunter_db[uid]
+            level, rank = get_hunter_stats(h.exp, uid)
+            text += f"<b>{i}.</b> {str(h.name).replace('<','&lt;')}{' '+h.username if h.username else ''} - Lvl {level} ({rank})\n"
+        if board.version == version: board.text = premium(text)
+    return board.text
+
 async def top_hunter_local(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
-    chat_id = update.effective_chat.id
-    members = chat_members_db.get(chat_id, set())
-    sorted_hunters = sorted([uid for uid in members if uid in hunter_db], key=lambda x: hunter_db[x]["exp"], reverse=True)[:10]
-    if not sorted_hunters: return await update.message.reply_text(premium("<b>No active hunters in this guild.</b> 🌸"), parse_mode="HTML")
-        
-    text = "<b>🏆 TOP 10 GUILD HUNTERS 🏆</b>\n\n"
-    for i, uid in enumerate(sorted_hunters, 1):
-        h = hunter_db[uid]
-        level, rank = get_hunter_stats(h["exp"], uid)
-        text += f"<b>{i}.</b> {str(h['name']).replace('<','&lt;')}{' '+h.get('username') if h.get('username') else ''} - Lvl {level} ({rank})\n"
-    await update.message.reply_text(premium(text), parse_mode="HTML")
+    await ensure_user_registered(update)
+    board = leaderboards.guilds.get(update.effective_chat.id)
+    if not board or not board.keys: return await update.message.reply_text(premium_static("<b>No active hunters in this guild.</b> 🌸"), parse_mode="HTML")
+    await update.message.reply_text(await render_leaderboard(board, "<b>🏆 TOP 10 GUILD HUNTERS 🏆</b>\n\n"), parse_mode="HTML")
 
 async def world_top_global(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
-    sorted_hunters = sorted(hunter_db.items(), key=lambda x: x[1]["exp"], reverse=True)[:10]
-    if not sorted_hunters: return await update.message.reply_text(premium("<b>The world is empty. No hunters found.</b> 🌸"), parse_mode="HTML")
-        
-    text = "<b>🌍 WORLD TOP 10 S-RANK HUNTERS 🌍</b>\n\n"
-    for i, (uid, h) in enumerate(sorted_hunters, 1):
-        level, rank = get_hunter_stats(h["exp"], uid)
-        text += f"<b>{i}.</b> {str(h['name']).replace('<','&lt;')}{' '+h.get('username') if h.get('username') else ''} - Lvl {level} ({rank})\n"
-    await update.message.reply_text(premium(text), parse_mode="HTML")
+    await ensure_user_registered(update)
+    if not leaderboards.world.keys: return await update.message.reply_text(premium_static("<b>The world is empty. No hunters found.</b> 🌸"), parse_mode="HTML")
+    await update.message.reply_text(await render_leaderboard(leaderboards.world, "<b>🌍 WORLD TOP 10 S-RANK HUNTERS 🌍</b>\n\n"), parse_mode="HTML")
 
 async def pvp_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     challenger = update.effective_user
     chat_id = update.effective_chat.id
     
-    if not update.message.reply_to_message: return await update.message.reply_text(premium("<b>❌ Reply to the Hunter you want to duel with:</b> `/pvp <amount>` ⚔️"), parse_mode="HTML")
+    if not update.message.reply_to_message: return await update.message.reply_text(premium_static("<b>❌ Reply to the Hunter you want to duel with:</b> `/pvp <amount>` ⚔️"), parse_mode="HTML")
     opponent = update.message.reply_to_message.from_user
     
-    if challenger.id == opponent.id or opponent.is_bot: return await update.message.reply_text(premium("<b>❌ System error: Invalid target for duel.</b> 🤡"), parse_mode="HTML")
-    if not context.args or not context.args[0].isdigit(): return await update.message.reply_text(premium("<b>❌ Correct format:</b> `/pvp <amount>` 🌸"), parse_mode="HTML")
+    if challenger.id == opponent.id or opponent.is_bot: return await update.message.reply_text(premium_static("<b>❌ System error: Invalid target for duel.</b> 🤡"), parse_mode="HTML")
+    if not context.args or not context.args[0].isdigit(): return await update.message.reply_text(premium_static("<b>❌ Correct format:</b> `/pvp <amount>` 🌸"), parse_mode="HTML")
         
     bet = int(context.args[0])
-    if bet < 10: return await update.message.reply_text(premium("<b>❌ Minimum bet is 10 EXP.</b> ✨"), parse_mode="HTML")
+    if bet < 10: return await update.message.reply_text(premium_static("<b>❌ Minimum bet is 10 EXP.</b> ✨"), parse_mode="HTML")
     
     c_data = hunter_db[challenger.id]
-    if c_data["exp"] < bet and challenger.id != OWNER_ID: return await update.message.reply_text(premium(f"<b>❌ You don't have enough EXP!</b> (You have {c_data['exp']}) 🥺"), parse_mode="HTML")
+    if c_data.exp < bet and challenger.id != OWNER_ID: return await update.message.reply_text(premium(f"<b>❌ You don't have enough EXP!</b> (You have {c_data.exp}) 🥺"), parse_mode="HTML")
         
     pvp_id = f"{chat_id}_{challenger.id}_{opponent.id}_{int(time.time())}"
     active_pvps[pvp_id] = {"c_id": challenger.id, "o_id": opponent.id, "bet": bet, "c_name": _display_name(challenger), "o_name": _display_name(opponent)}
@@ -646,6 +1540,14 @@ async def pvp_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(premium(text), parse_mode="HTML", reply_markup=markup)
 
 async def pvp_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Both fighters' EXP is read, bet and paid out across awaits, so the duel and
+    # both hunters stay locked until it settles
+    pvp_id = "_".join(update.callback_query.data.split("_")[2:])
+    pvp = active_pvps.get(pvp_id, {})
+    async with keyed_locks.hold(("pvp", pvp_id), *[("hunter", uid) for uid in (pvp.get("c_id"), pvp.get("o_id")) if uid]):
+        await settle_pvp(update, context)
+
+async def settle_pvp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     data = query.data.split("_")
@@ -655,40 +1557,42 @@ async def pvp_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     pvp = active_pvps[pvp_id]
     
     if user_id != pvp["o_id"] and user_id != pvp["c_id"]: return await query.answer("This duel is not for you!", show_alert=True)
+    await hunter_db.load_many([pvp["c_id"], pvp["o_id"]])
+    if pvp["c_id"] not in hunter_db or pvp["o_id"] not in hunter_db: return await query.answer("Hunter data unavailable, try again!", show_alert=True)
     if action == "decline" and user_id == pvp["o_id"]:
         del active_pvps[pvp_id]
         return await query.edit_message_text(premium(f"<b>🏃 {pvp['o_name']} declined the duel. Coward!</b> 😂"), parse_mode="HTML")
     
     if action == "accept" and user_id == pvp["o_id"]:
-        if hunter_db[pvp["o_id"]]["exp"] < pvp["bet"] and pvp["o_id"] != OWNER_ID:
+        if hunter_db[pvp["o_id"]].exp < pvp["bet"] and pvp["o_id"] != OWNER_ID:
             return await query.answer("You don't have enough EXP to accept!", show_alert=True)
             
-        await query.edit_message_text(premium(f"<b>⚔️ DUEL STARTED!</b>\n{pvp['c_name']} VS {pvp['o_name']}\n\n<i>Clashing weapons...</i> 🔥"), parse_mode="HTML")
-        await asyncio.sleep(1.5)
-        
-        c_lvl, _ = get_hunter_stats(hunter_db[pvp["c_id"]]["exp"], pvp["c_id"])
-        o_lvl, _ = get_hunter_stats(hunter_db[pvp["o_id"]]["exp"], pvp["o_id"])
+        c_lvl, _ = get_hunter_stats(hunter_db[pvp["c_id"]].exp, pvp["c_id"])
+        o_lvl, _ = get_hunter_stats(hunter_db[pvp["o_id"]].exp, pvp["o_id"])
         
         c_weight = c_lvl if c_lvl != "MAX" else 999
         o_weight = o_lvl if o_lvl != "MAX" else 999
         
         winner_id, loser_id = (pvp["c_id"], pvp["o_id"]) if random.choices([True, False], weights=[c_weight+10, o_weight+10])[0] else (pvp["o_id"], pvp["c_id"])
         
-        if winner_id != OWNER_ID: hunter_db[winner_id]["exp"] += pvp["bet"]
-        if loser_id != OWNER_ID: hunter_db[loser_id]["exp"] = max(0, hunter_db[loser_id]["exp"] - pvp["bet"])
+        if winner_id != OWNER_ID: hunter_db[winner_id].exp += pvp["bet"]
+        if loser_id != OWNER_ID: hunter_db[loser_id].exp = max(0, hunter_db[loser_id].exp - pvp["bet"])
         
         save_hunter(winner_id); save_hunter(loser_id)
-        w_name = hunter_db[winner_id]["name"]
-        l_name = hunter_db[loser_id]["name"]
+        w_name = hunter_db[winner_id].name
+        l_name = hunter_db[loser_id].name
         
         text = f"<b>🏆 DUEL FINISHED! 🏆</b>\n\n💥 {w_name} dominated the fight and defeated {l_name}!\n\n🏅 <b>{w_name}</b> won {pvp['bet']} EXP! 🎉"
-        await query.edit_message_text(premium(text), parse_mode="HTML")
         del active_pvps[pvp_id]
+        # Settled already; the result is scheduled only once the clash is on screen,
+        # so a slow "started" edit can never land on top of it
+        try: await query.edit_message_text(premium(f"<b>⚔️ DUEL STARTED!</b>\n{pvp['c_name']} VS {pvp['o_name']}\n\n<i>Clashing weapons...</i> 🔥"), parse_mode="HTML")
+        finally: defer_edit(context, 1.5, query.message.chat.id, query.message.message_id, premium(text), parse_mode="HTML")
 
 async def shop_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     user = update.effective_user
-    cryst = hunter_db[user.id].get("crystals", 0)
+    cryst = hunter_db[user.id].crystals
     
     markup = InlineKeyboardMarkup([
         [InlineKeyboardButton("🧪 Healing Potion (50 🔮) - Remove 1 Warn", callback_data="shop_heal")],
@@ -702,44 +1606,97 @@ async def shop_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = query.from_user.id
     action = query.data.split("_")[1]
     chat_id = query.message.chat.id
+    await ensure_user_registered(update)
     
     data = hunter_db[user_id]
-    cryst = data.get("crystals", 0)
+    cryst = data.crystals
     
     if action == "heal":
         if cryst < 50 and user_id != OWNER_ID: return await query.answer("Not enough crystals!", show_alert=True)
         if warnings_db[chat_id][user_id] <= 0: return await query.answer("You have 0 warnings, no need to heal!", show_alert=True)
-        if user_id != OWNER_ID: data["crystals"] -= 50
+        if user_id != OWNER_ID: data.crystals -= 50
         warnings_db[chat_id][user_id] -= 1
         save_hunter(user_id)
         await query.answer("Purchased Healing Potion! 1 Warning removed.", show_alert=True)
         
     elif action == "key":
         if cryst < 100 and user_id != OWNER_ID: return await query.answer("Not enough crystals!", show_alert=True)
-        if user_id != OWNER_ID: data["crystals"] -= 100
-        data["last_hunt"] = 0
+        if user_id != OWNER_ID: data.crystals -= 100
+        data.last_hunt = 0
         save_hunter(user_id)
         await query.answer("Purchased Dungeon Key! You can /hunt again right now.", show_alert=True)
         
     elif action == "title":
         if cryst < 500 and user_id != OWNER_ID: return await query.answer("Not enough crystals!", show_alert=True)
-        if user_id != OWNER_ID: data["crystals"] -= 500
+        if user_id != OWNER_ID: data.crystals -= 500
         titles = ["Shadow Monarch", "S-Rank Elite", "Guild Master's Right Hand", "Demon King", "Dragon Slayer"]
         new_title = random.choice(titles)
-        data["title"] = new_title
+        data.title = new_title
         save_hunter(user_id)
         await query.answer(f"Purchased Title! You are now known as: {new_title}", show_alert=True)
 
 # ------------- DUNGEON SYSTEM -------------
+# Button clicks change the boss in memory straight away, but the message is
+# re-rendered by one coalescer task per dungeon: a single edit in flight, at most
+# one per DUNGEON_EDIT_INTERVAL, always ending on the latest HP. Clearing or
+# breaking the gate waits for an in-flight edit before writing the final caption.
+DUNGEON_EDIT_INTERVAL = float(os.environ.get("DUNGEON_EDIT_INTERVAL", "1.0"))
+dungeon_stats = {"clicks": 0, "edits": 0, "flood_waits": 0}
+
+def dungeon_markup(dungeon):
+    if dungeon["type"] == 1: return InlineKeyboardMarkup([[InlineKeyboardButton(f"⚔️ ATTACK (HP: {dungeon['hp']})", callback_data="dungeon_attack")]])
+    return InlineKeyboardMarkup([[InlineKeyboardButton(f"🛡️ JOIN RAID ({len(dungeon['participants'])}/3)", callback_data="dungeon_join")]])
+
+def request_dungeon_render(bot, chat_id, dungeon):
+    dungeon_stats["clicks"] += 1
+    dungeon["dirty"] = True
+    task = dungeon.get("render_task")
+    if task is None or task.done(): dungeon["render_task"] = asyncio.create_task(render_dungeon(bot, chat_id, dungeon))
+
+async def render_dungeon(bot, chat_id, dungeon):
+    while dungeon["dirty"] and active_dungeons.get(chat_id) is dungeon:
+        dungeon["dirty"] = False
+        # The edit runs as its own task so stop_dungeon_render can await exactly
+        # it; shielded, cancelling this loop never abandons a request mid-flight
+        edit = dungeon["edit_task"] = asyncio.ensure_future(bot.edit_message_reply_markup(chat_id=chat_id, message_id=dungeon["msg_id"], reply_markup=dungeon_markup(dungeon)))
+        edit.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            await asyncio.shield(edit)
+            dungeon_stats["edits"] += 1
+        except RetryAfter as e:
+            dungeon_stats["flood_waits"] += 1
+            dungeon["dirty"] = True
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception: pass
+        await asyncio.sleep(DUNGEON_EDIT_INTERVAL)
+
+async def stop_dungeon_render(dungeon):
+    task = dungeon.get("render_task")
+    if task is None or task.done(): return
+    task.cancel()
+    # An edit already sent must land before the final caption, or it would
+    # bring the button back; a task that is only waiting can just go.
+    edit = dungeon.get("edit_task")
+    if edit is not None and not edit.done(): await asyncio.wait([edit], timeout=10)
+
+async def edit_final_caption(bot, chat_id, dungeon, caption):
+    for _ in range(3):
+        try: return await bot.edit_message_caption(chat_id=chat_id, message_id=dungeon["msg_id"], caption=caption, parse_mode="HTML")
+        except RetryAfter as e:
+            dungeon_stats["flood_waits"] += 1
+            await asyncio.sleep(e.retry_after)
+
 async def gate_break(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data
     if chat_id in active_dungeons:
         dungeon = active_dungeons.pop(chat_id)
         penalty = dungeon['penalty']
         affected = 0
+        await hunter_db.load_many(list(chat_members_db.get(chat_id, set())))
         for uid in chat_members_db.get(chat_id, set()):
             if uid in hunter_db and uid != OWNER_ID:
-                hunter_db[uid]["exp"] = max(0, hunter_db[uid]["exp"] - penalty)
+                hunter_db[uid].exp = max(0, hunter_db[uid].exp - penalty)
                 save_hunter(uid)
                 affected += 1
                 
@@ -751,7 +1708,8 @@ async def gate_break(context: ContextTypes.DEFAULT_TYPE):
 👹 <b>BOSS NAME:</b> <code> {DUNGEON_RANKS[dungeon['rank']]['name']} (ESCAPED) </code> ⚠️""")
         
         try:
-            await context.bot.edit_message_caption(chat_id=chat_id, message_id=dungeon["msg_id"], caption=break_caption, parse_mode="HTML")
+            await stop_dungeon_render(dungeon)
+            await edit_final_caption(context.bot, chat_id, dungeon, break_caption)
             await context.bot.send_message(chat_id, premium(f"<b>🚨 GATE BREAK!</b> The Boss escaped and attacked the Guild!\n📉 Penalty: {affected} active Hunters lost {penalty} EXP. 😭"), parse_mode="HTML")
         except: pass
 
@@ -764,14 +1722,15 @@ async def clear_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat
     reward = dungeon["reward"]
     cryst = dungeon["crystals"]
     winners_text = ""
+    await hunter_db.load_many(list(participants) + [last_hitter_id])
     
     for uid in participants:
         if uid in hunter_db and uid != OWNER_ID:
-            hunter_db[uid]["exp"] += reward
-            hunter_db[uid]["crystals"] += cryst
+            hunter_db[uid].exp += reward
+            hunter_db[uid].crystals += cryst
             save_hunter(uid)
-            uname = hunter_db[uid].get('username', '')
-            display_uname = uname if uname else hunter_db[uid]['name']
+            uname = hunter_db[uid].username
+            display_uname = uname if uname else hunter_db[uid].name
             winners_text += f"🗡️ {display_uname} <code> (+{reward} EXP, +{cryst} 🔮) </code>\n"
             
     clear_caption = premium(f"""<b>✅ [ SYSTEM NOTIFICATION ] ✅</b>
@@ -782,7 +1741,8 @@ async def clear_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat
 👹 <b>BOSS NAME:</b> <code> {DUNGEON_RANKS[dungeon['rank']]['name']} (DEFEATED) </code> ✨""")
             
     try:
-        await context.bot.edit_message_caption(chat_id=chat_id, message_id=dungeon["msg_id"], caption=clear_caption, parse_mode="HTML")
+        await stop_dungeon_render(dungeon)
+        await edit_final_caption(context.bot, chat_id, dungeon, clear_caption)
         
         boss_name = DUNGEON_RANKS[dungeon['rank']]['name']
         new_msg = premium(f"""<b>🎊 DUNGEON CONQUERED! 🎊</b>
@@ -790,7 +1750,7 @@ async def clear_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat
 <b>🏆 HEROES OF THE RAID:</b>
 {winners_text}
 
-🌑 {mention_html(last_hitter_id, hunter_db[last_hitter_id]['name'])}, you delivered the final blow! The Boss's soul lingers.
+🌑 {mention_html(last_hitter_id, hunter_db[last_hitter_id].name)}, you delivered the final blow! The Boss's soul lingers.
 ⏳ You have 30 seconds to type <code>/arise</code> and attempt Shadow Extraction! ✨""")
         
         await context.bot.send_message(chat_id, new_msg, parse_mode="HTML")
@@ -798,25 +1758,32 @@ async def clear_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat
     except: pass
 
 async def arise_shadow(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user_registered(update)
+    await ensure_user_registered(update)
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
     
     if chat_id not in arise_targets or arise_targets[chat_id]["uid"] != user_id:
-        return await update.message.reply_text(premium("<b>❌ There is no shadow for you to extract here, or you lack the authority.</b> 🤡"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ There is no shadow for you to extract here, or you lack the authority.</b> 🤡"), parse_mode="HTML")
         
     target = arise_targets.pop(chat_id)
     if time.time() - target["time"] > 30:
-        return await update.message.reply_text(premium("<b>❌ You took too long. The shadow faded into the abyss.</b> 😢"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ You took too long. The shadow faded into the abyss.</b> 😢"), parse_mode="HTML")
         
     if random.choice([True, False]):
-        hunter_db[user_id]["shadows"].append(target["boss"])
+        hunter_db[user_id].add_shadow(target["boss"])
         save_hunter(user_id)
         await update.message.reply_text(premium(f"<b>🌑 SHADOW EXTRACTION SUCCESSFUL! 🌑</b>\n\n<i>\"Arise.\"</i>\n{target['boss']} is now your loyal Shadow Soldier! 👑"), parse_mode="HTML")
     else:
         await update.message.reply_text(premium(f"<b>🌑 SHADOW EXTRACTION FAILED. 🌑</b>\n\n<i>The soul of {target['boss']} resisted your command and vanished.</i> 💔"), parse_mode="HTML")
 
 async def spawn_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    # Two groups' worth of messages can both hit the spawn count while the video
+    # uploads; the second one finds the gate already open and backs off
+    async with keyed_locks.hold(("dungeon", chat_id)):
+        if chat_id in active_dungeons: return
+        await open_dungeon(update, context, chat_id)
+
+async def open_dungeon(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
     ranks = ["E", "E", "D", "D", "C", "C", "B", "A", "S", "RED"]
     rank = random.choice(ranks)
     data = DUNGEON_RANKS[rank]
@@ -871,51 +1838,49 @@ async def dungeon_button_handler(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     chat_id = query.message.chat.id
     user_id = query.from_user.id
-    ensure_user_registered(update)
-    
-    if chat_id not in active_dungeons: return await query.answer("Dungeon is already closed or broken!", show_alert=True)
-    dungeon = active_dungeons[chat_id]
+    await ensure_user_registered(update)
     
-    if query.data == "dungeon_attack" and dungeon["type"] == 1:
-        if user_id not in dungeon["participants"]: dungeon["participants"].append(user_id)
-        dmg = random.randint(10, max(15, dungeon["max_hp"] // 10))
-        dungeon["hp"] -= dmg
+    # The kill clears the gate under the chat's lock so a second finishing blow
+    # can't pay out twice; ordinary hits answer after letting go of it
+    async with keyed_locks.hold(("dungeon", chat_id)):
+        if chat_id not in active_dungeons: return await query.answer("Dungeon is already closed or broken!", show_alert=True)
+        dungeon = active_dungeons[chat_id]
         
-        if dungeon["hp"] <= 0:
-            await query.answer("Boss Defeated! 🩸", show_alert=True)
-            await clear_dungeon(update, context, chat_id, dungeon["participants"], user_id)
-        else:
-            try:
-                await query.answer(f"Dealt {dmg} DMG! ⚔️")
-                markup = InlineKeyboardMarkup([[InlineKeyboardButton(f"⚔️ ATTACK (HP: {dungeon['hp']})", callback_data="dungeon_attack")]])
-                await query.edit_message_reply_markup(reply_markup=markup)
-            except: pass
+        if query.data == "dungeon_attack" and dungeon["type"] == 1:
+            if user_id not in dungeon["participants"]: dungeon["participants"].append(user_id)
+            dmg = random.randint(10, max(15, dungeon["max_hp"] // 10))
+            dungeon["hp"] -= dmg
+            
+            if dungeon["hp"] <= 0:
+                await query.answer("Boss Defeated! 🩸", show_alert=True)
+                return await clear_dungeon(update, context, chat_id, dungeon["participants"], user_id)
+            reply = f"Dealt {dmg} DMG! ⚔️"
+                
+        elif query.data == "dungeon_join" and dungeon["type"] == 3:
+            if user_id in dungeon["participants"]: return await query.answer("You already joined the raid!", show_alert=True)
+            dungeon["participants"].append(user_id)
+            count = len(dungeon["participants"])
             
-    elif query.data == "dungeon_join" and dungeon["type"] == 3:
-        if user_id in dungeon["participants"]: return await query.answer("You already joined the raid!", show_alert=True)
-        dungeon["participants"].append(user_id)
-        count = len(dungeon["participants"])
+            if count >= 3:
+                await query.answer("Raid Full! Boss Defeated! 🛡️", show_alert=True)
+                return await clear_dungeon(update, context, chat_id, dungeon["participants"], user_id)
+            reply = "You joined the raid! 🛡️"
+        else: return
+        request_dungeon_render(context.bot, chat_id, dungeon)
         
-        if count >= 3:
-            await query.answer("Raid Full! Boss Defeated! 🛡️", show_alert=True)
-            await clear_dungeon(update, context, chat_id, dungeon["participants"], user_id)
-        else:
-            try:
-                await query.answer("You joined the raid! 🛡️")
-                markup = InlineKeyboardMarkup([[InlineKeyboardButton(f"🛡️ JOIN RAID ({count}/3)", callback_data="dungeon_join")]])
-                await query.edit_message_reply_markup(reply_markup=markup)
-            except: pass
+    try: await query.answer(reply)
+    except: pass
 
 # ------------- MODERATION COMMANDS -------------
 async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text: return
     action = update.message.text.split()[0][1:].split('@')[0].lower()
     if not await check_rights(update, action): 
-        return await update.message.reply_text(premium("<b>❌ You don't have Admin rights/permissions to do this.</b> 🤡"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ You don't have Admin rights/permissions to do this.</b> 🤡"), parse_mode="HTML")
     
     target_id = await get_user_id(update, context)
     if not target_id and action not in ["unpin"]: 
-        return await update.message.reply_text(premium("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
     chat_id = update.effective_chat.id
     target_mention = mention_html(target_id, "User")
 
@@ -939,11 +1904,11 @@ async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif action == "pin":
             if update.message.reply_to_message: 
                 await context.bot.pin_chat_message(chat_id, update.message.reply_to_message.message_id)
-                await update.message.reply_text(premium("<b>📌 Pinned successfully!</b> ✨"), parse_mode="HTML")
+                await update.message.reply_text(premium_static("<b>📌 Pinned successfully!</b> ✨"), parse_mode="HTML")
         elif action == "unpin":
             if update.message.reply_to_message: await context.bot.unpin_chat_message(chat_id, update.message.reply_to_message.message_id)
             else: await context.bot.unpin_chat_message(chat_id)
-            await update.message.reply_text(premium("<b>✅ Unpinned successfully!</b> 🌸"), parse_mode="HTML")
+            await update.message.reply_text(premium_static("<b>✅ Unpinned successfully!</b> 🌸"), parse_mode="HTML")
         elif action == "promote":
             await context.bot.promote_chat_member(chat_id, target_id, can_manage_chat=True, can_delete_messages=True, can_manage_video_chats=True, can_restrict_members=True, can_promote_members=False, can_change_info=True, can_invite_users=True, can_pin_messages=True)
             await update.message.reply_text(premium(f"<b>🌟 Promoted!</b>\n{target_mention} is now an Admin! 👑✨"), parse_mode="HTML")
@@ -959,31 +1924,31 @@ async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e: await update.message.reply_text(premium(f"<b>❌ System Error:</b> {e} ☠️"), parse_mode="HTML")
 
 async def purge(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "purge"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
-    if not update.message.reply_to_message: return await update.message.reply_text(premium("<b>❌ Reply to the oldest message to start purge.</b> ✨"), parse_mode="HTML")
+    if not await check_rights(update, "purge"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not update.message.reply_to_message: return await update.message.reply_text(premium_static("<b>❌ Reply to the oldest message to start purge.</b> ✨"), parse_mode="HTML")
     try:
         start_id, end_id, chat_id = update.message.reply_to_message.message_id, update.message.message_id, update.effective_chat.id
         msg_ids = list(range(start_id, end_id + 1))
         for i in range(0, len(msg_ids), 100):
             try: await context.bot.delete_messages(chat_id, msg_ids[i:i+100])
             except: pass 
-        ack = await context.bot.send_message(chat_id, premium("<b>✅ Purge complete! Area secured.</b> 🧹✨"), parse_mode="HTML"); await asyncio.sleep(3); await ack.delete()
+        ack = await context.bot.send_message(chat_id, premium_static("<b>✅ Purge complete! Area secured.</b> 🧹✨"), parse_mode="HTML"); defer_delete(context, 3, chat_id, ack.message_id)
     except Exception as e: await update.message.reply_text(premium(f"<b>Error:</b> {e} ⚠️"), parse_mode="HTML")
 
 async def purge_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "purgegroup"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not await check_rights(update, "purgegroup"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
     chat_id, curr = update.effective_chat.id, update.message.message_id
     try:
         msg_ids = list(range(max(1, curr - 100), curr + 1))
         for i in range(0, len(msg_ids), 100):
             try: await context.bot.delete_messages(chat_id, msg_ids[i:i+100])
             except: pass
-        ack = await context.bot.send_message(chat_id, premium("<b>✅ Group cleanup (Last 100 messages) complete!</b> 🫧🌸"), parse_mode="HTML"); await asyncio.sleep(5); await ack.delete()
-    except: await update.message.reply_text(premium("<b>❌ Messages too old/already deleted.</b> 🥺"), parse_mode="HTML")
+        ack = await context.bot.send_message(chat_id, premium_static("<b>✅ Group cleanup (Last 100 messages) complete!</b> 🫧🌸"), parse_mode="HTML"); defer_delete(context, 5, chat_id, ack.message_id)
+    except: await update.message.reply_text(premium_static("<b>❌ Messages too old/already deleted.</b> 🥺"), parse_mode="HTML")
 
 async def purge_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "purgeall"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
-    if not update.message.reply_to_message: return await update.message.reply_text(premium("<b>❌ Reply to the user whose messages you want to purge.</b> ✨"), parse_mode="HTML")
+    if not await check_rights(update, "purgeall"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not update.message.reply_to_message: return await update.message.reply_text(premium_static("<b>❌ Reply to the user whose messages you want to purge.</b> ✨"), parse_mode="HTML")
     
     chat_id = update.effective_chat.id
     target_id = update.message.reply_to_message.from_user.id
@@ -993,7 +1958,7 @@ async def purge_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg_ids_to_delete.append(update.message.message_id) 
         
         if not msg_ids_to_delete or len(msg_ids_to_delete) <= 1:
-            return await update.message.reply_text(premium("<b>❌ Is user ke koi recent messages history mein nahi mile.</b> 🤔"), parse_mode="HTML")
+            return await update.message.reply_text(premium_static("<b>❌ Is user ke koi recent messages history mein nahi mile.</b> 🤔"), parse_mode="HTML")
             
         for i in range(0, len(msg_ids_to_delete), 100):
             try: await context.bot.delete_messages(chat_id, msg_ids_to_delete[i:i+100])
@@ -1001,7 +1966,7 @@ async def purge_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         recent_messages_db[chat_id] = deque([(m, u) for m, u in recent_messages_db[chat_id] if u != target_id], maxlen=1000)
         
-        ack = await context.bot.send_message(chat_id, premium("<b>✅ User ke sabhi recent messages delete ho gaye!</b> 🧹✨"), parse_mode="HTML"); await asyncio.sleep(5); await ack.delete()
+        ack = await context.bot.send_message(chat_id, premium_static("<b>✅ User ke sabhi recent messages delete ho gaye!</b> 🧹✨"), parse_mode="HTML"); defer_delete(context, 5, chat_id, ack.message_id)
     except Exception as e: await update.message.reply_text(premium(f"<b>❌ Failed to purge all:</b> {e} ⚠️"), parse_mode="HTML")
 
 async def commands_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1040,13 +2005,12 @@ async def commands_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(premium(text), parse_mode="HTML")
 
 async def warn_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "warn"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not await check_rights(update, "warn"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
     target_id = await get_user_id(update, context)
-    if not target_id: return await update.message.reply_text(premium("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
+    if not target_id: return await update.message.reply_text(premium_static("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
     chat_id = update.effective_chat.id
     try:
-        target_member = await context.bot.get_chat_member(chat_id, target_id)
-        if target_id in admins_db or target_member.status in ['administrator', 'creator']: return await update.message.reply_text(premium("<b>❌ Cannot warn an Admin.</b> 👑"), parse_mode="HTML")
+        if target_id in admins_db or await admin_rosters.member(context.bot, chat_id, target_id) is not None: return await update.message.reply_text(premium_static("<b>❌ Cannot warn an Admin.</b> 👑"), parse_mode="HTML")
     except: pass
 
     warnings_db[chat_id][target_id] += 1
@@ -1064,51 +2028,51 @@ async def warn_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else: await update.message.reply_text(premium(f"<b>⚠️ Warned!</b>\nUser {target_id} has been warned! ({count}/3)\n<b>Reason:</b> {reason} ✨"), parse_mode="HTML")
 
 async def unwarn_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "unwarn"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not await check_rights(update, "unwarn"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
     target_id = await get_user_id(update, context)
-    if not target_id: return await update.message.reply_text(premium("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
+    if not target_id: return await update.message.reply_text(premium_static("<b>❌ User not found!</b> Reply to their message, or provide a valid ID/Username. 🥺"), parse_mode="HTML")
     chat_id = update.effective_chat.id
     if warnings_db[chat_id][target_id] > 0:
         warnings_db[chat_id][target_id] -= 1
         await update.message.reply_text(premium(f"<b>✅ Removed 1 warning.</b> Current warns: {warnings_db[chat_id][target_id]}/3 🌸"), parse_mode="HTML")
-    else: await update.message.reply_text(premium("<b>✅ User has 0 warnings.</b> ✨"), parse_mode="HTML")
+    else: await update.message.reply_text(premium_static("<b>✅ User has 0 warnings.</b> ✨"), parse_mode="HTML")
 
 async def set_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_rights(update, "rules"): return await update.message.reply_text("❌ Admin rights required.", parse_mode="HTML")
     text = update.message.text.split(None, 1)
     if len(text) < 2: return await update.message.reply_text("❌ Please provide rules text.", parse_mode="HTML")
     rules_db[update.effective_chat.id] = text[1]
-    await update.message.reply_text(premium("<b>✅ Rules updated successfully!</b> 🌸"), parse_mode="HTML")
+    await update.message.reply_text(premium_static("<b>✅ Rules updated successfully!</b> 🌸"), parse_mode="HTML")
 
 async def show_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(premium(f"<b>📜 Group Rules:</b>\n\n{rules_db.get(update.effective_chat.id, 'No rules set yet.')} ✨"), parse_mode="HTML")
 
 async def add_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
-    if not context.args: return await update.message.reply_text(premium("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
-    blacklist_db[update.effective_chat.id].add(context.args[0].lower()); await update.message.reply_text(premium(f"<b>✅ Word '{context.args[0]}' added to blacklist.</b> 🌸"), parse_mode="HTML")
+    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not context.args: return await update.message.reply_text(premium_static("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
+    blacklist_db[update.effective_chat.id].add(context.args[0].lower()); rebuild_blacklist(update.effective_chat.id); await update.message.reply_text(premium(f"<b>✅ Word '{context.args[0]}' added to blacklist.</b> 🌸"), parse_mode="HTML")
 
 async def rm_blacklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
-    if not context.args: return await update.message.reply_text(premium("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
-    blacklist_db[update.effective_chat.id].discard(context.args[0].lower()); await update.message.reply_text(premium(f"<b>✅ Word '{context.args[0]}' removed from blacklist.</b> ✨"), parse_mode="HTML")
+    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not context.args: return await update.message.reply_text(premium_static("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
+    blacklist_db[update.effective_chat.id].discard(context.args[0].lower()); rebuild_blacklist(update.effective_chat.id); await update.message.reply_text(premium(f"<b>✅ Word '{context.args[0]}' removed from blacklist.</b> ✨"), parse_mode="HTML")
 
 async def show_blocklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not await check_rights(update, "blacklist"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
     words = blacklist_db[update.effective_chat.id]
-    if not words: return await update.message.reply_text(premium("<b>✅ Blocklist ekdum khali hai.</b> 🌸"), parse_mode="HTML")
+    if not words: return await update.message.reply_text(premium_static("<b>✅ Blocklist ekdum khali hai.</b> 🌸"), parse_mode="HTML")
     await update.message.reply_text(premium("<b>🚫 Blocked Words:</b>\n" + "\n".join([f"- <code>{w}</code>" for w in words])), parse_mode="HTML")
 
 async def add_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "filter"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not await check_rights(update, "filter"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
     text = update.message.text.split(None, 2)
-    if len(text) < 3: return await update.message.reply_text(premium("<b>❌ Format: /addfilter &lt;word&gt; &lt;reply&gt;</b> 🥺"), parse_mode="HTML")
-    filters_db[update.effective_chat.id][text[1].lower()] = text[2]; await update.message.reply_text(premium("<b>✅ Filter added successfully!</b> 🎀"), parse_mode="HTML")
+    if len(text) < 3: return await update.message.reply_text(premium_static("<b>❌ Format: /addfilter &lt;word&gt; &lt;reply&gt;</b> 🥺"), parse_mode="HTML")
+    filters_db[update.effective_chat.id][text[1].lower()] = text[2]; rebuild_triggers(update.effective_chat.id, (context.bot.username or "").lower()); await update.message.reply_text(premium_static("<b>✅ Filter added successfully!</b> 🎀"), parse_mode="HTML")
 
 async def rm_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_rights(update, "filter"): return await update.message.reply_text(premium("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
-    if not context.args: return await update.message.reply_text(premium("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
-    filters_db[update.effective_chat.id].pop(context.args[0].lower(), None); await update.message.reply_text(premium("<b>✅ Filter removed!</b> ✨"), parse_mode="HTML")
+    if not await check_rights(update, "filter"): return await update.message.reply_text(premium_static("<b>❌ Admin rights required.</b> 🤡"), parse_mode="HTML")
+    if not context.args: return await update.message.reply_text(premium_static("<b>❌ Provide a word.</b> 🥺"), parse_mode="HTML")
+    filters_db[update.effective_chat.id].pop(context.args[0].lower(), None); rebuild_triggers(update.effective_chat.id, (context.bot.username or "").lower()); await update.message.reply_text(premium_static("<b>✅ Filter removed!</b> ✨"), parse_mode="HTML")
 
 async def set_afk(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reason = " ".join(context.args) if context.args else "No reason"
@@ -1116,37 +2080,119 @@ async def set_afk(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(premium(f"<b>💤 {_display_name(update.effective_user)} is now AFK.</b>\nReason: {reason} 😴"), parse_mode="HTML")
 
 async def get_anime(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args: return await update.message.reply_text(premium("<b>❌ Search naam toh batao!</b> (e.g., /anime naruto) 🥺"), parse_mode="HTML")
+    if not context.args: return await update.message.reply_text(premium_static("<b>❌ Search naam toh batao!</b> (e.g., /anime naruto) 🥺"), parse_mode="HTML")
     query = " ".join(context.args)
-    try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(f"https://api.jikan.moe/v4/anime?q={query}&limit=1")
+    async with typing_ticker.hold(context.bot, update.effective_chat.id):
+        try:
+            res = await http_request("jikan", "GET", "/anime", params={"q": query, "limit": 1})
             data = res.json()
             if data['data']:
                 anime = data['data'][0]
                 await update.message.reply_text(premium(f"<b>🎬 {anime['title']}</b>\n\n📊 <b>Score:</b> {anime.get('score', 'N/A')}\n🎞 <b>Episodes:</b> {anime.get('episodes', 'N/A')}\n🔄 <b>Status:</b> {anime.get('status', 'N/A')}\n\n🔗 <a href='{anime['url']}'>More Info</a> ✨"), parse_mode="HTML")
-            else: await update.message.reply_text(premium("<b>❌ Anime not found!</b> 🥺"), parse_mode="HTML")
-    except: await update.message.reply_text(premium("<b>❌ API error.</b> ☠️"), parse_mode="HTML")
+            else: await update.message.reply_text(premium_static("<b>❌ Anime not found!</b> 🥺"), parse_mode="HTML")
+        except: await update.message.reply_text(premium_static("<b>❌ API error.</b> ☠️"), parse_mode="HTML")
 
 # ------------- ADMIN PANEL -------------
+def system_stats_text():
+    lat = persist_stats["latency"]
+    hs = hunter_db.stats
+    sections = ["<b>📈 SYSTEM STATS</b>"]
+    sections.append(f"""<b>👥 Hunter Cache:</b>
+├── <b>Resident:</b> {len(hunter_db)}/{hunter_db.capacity}
+└── <b>Hits:</b> {hs['hits']} | <b>Loads:</b> {hs['loads']} | <b>Misses:</b> {hs['misses']} | <b>Evicted:</b> {hs['evictions']}""")
+    sections.append(f"""<b>💾 Persistence:</b>
+├── <b>Queue Depth:</b> {pending_count()}
+├── <b>Flushes:</b> {persist_stats['flushes']} ({persist_stats['docs']} docs, {persist_stats['coalesced']} coalesced)
+├── <b>Flush Latency:</b> p50 {lat.percentile(50):.0f}ms | p95 {lat.percentile(95):.0f}ms
+└── <b>Errors:</b> {persist_stats['errors']}""")
+    http_lines = [f"├── <b>{name}:</b> {st['requests']} reqs, {st['inflight']} in-flight, {http_pool_size(name)} conns, {st['errors']} errors | p50 {st['latency'].percentile(50):.0f}ms p95 {st['latency'].percentile(95):.0f}ms" for name, st in http_stats.items()]
+    if http_lines:
+        http_lines[-1] = "└" + http_lines[-1][1:]
+        sections.append("<b>🌐 HTTP Pools:</b>\n" + "\n".join(http_lines))
+    ttft, total = ai_stats["ttft"], ai_stats["total_ms"]
+    outcomes = ", ".join(f"{k} {v}" for k, v in sorted(ai_stats["outcomes"].items()))
+    attempts = ", ".join(f"{k} {v}" for k, v in sorted(ai_stats["attempts"].items(), key=lambda item: str(item[0])))
+    wins = ", ".join(f"{m.split('/')[-1]} {n}" for m, n in sorted(ai_stats["wins"].items(), key=lambda item: -item[1]))
+    sections.append(f"""<b>⚡ AI Replies:</b>
+├── <b>Mode:</b> {"streaming" if AI_STREAM else "single message"} | <b>Replies:</b> {ai_stats['replies']} ({ai_stats['streamed']} streamed, {ai_stats['coalesced']} messages merged)
+├── <b>First Visible Text:</b> p50 {ttft.percentile(50):.0f}ms | p95 {ttft.percentile(95):.0f}ms
+├── <b>End-to-End:</b> p50 {total.percentile(50):.0f}ms | p95 {total.percentile(95):.0f}ms | <b>Second Sweeps:</b> {ai_stats['second_sweeps']}
+├── <b>Outcomes:</b> {outcomes or "none yet"}
+├── <b>Attempts:</b> {attempts or "none yet"} | p50 {ai_stats['attempt_ms'].percentile(50):.0f}ms
+├── <b>Answered By:</b> {wins or "none yet"}
+├── <b>Tokens:</b> {ai_stats['tokens_in']} in / {ai_stats['tokens_out']} out (p50 {ai_stats['prompt_tokens'].percentile(50):.0f} / {ai_stats['completion_tokens'].percentile(50):.0f} per reply) | <b>Cost:</b> ${ai_stats['cost']:.4f}
+└── <b>Chat Actions:</b> {len(typing_ticker.chats)} active | {typing_ticker.stats['sent']} sent | {typing_ticker.stats['shared']} shared holds""")
+    queue_lines = ai_queue.status_lines()
+    sections.append(f"<b>🚦 AI Admission:</b>\n├── {queue_lines[0]}\n├── {queue_lines[1]}\n└── {queue_lines[2]}")
+    broadcast_lines = [f"├── {line}" for line in broadcast_status_lines()]
+    broadcast_lines[-1] = "└" + broadcast_lines[-1][1:]
+    sections.append("<b>📢 Broadcast:</b>\n" + "\n".join(broadcast_lines))
+    sections.append(f"""<b>⚔️ Dungeons:</b>
+├── <b>Active:</b> {len(active_dungeons)}
+└── <b>Clicks:</b> {dungeon_stats['clicks']} | <b>Edits:</b> {dungeon_stats['edits']} | <b>Flood Waits:</b> {dungeon_stats['flood_waits']}""")
+    sections.append(f"""<b>🔀 Updates:</b>
+├── <b>Concurrency:</b> {UPDATE_CONCURRENCY}
+├── <b>Locks Held:</b> {len(keyed_locks.locks)} | <b>Acquired:</b> {keyed_locks.stats['acquired']} | <b>Contended:</b> {keyed_locks.stats['contended']}
+└── <b>Deferred:</b> {deferred_stats['scheduled']} scheduled | {deferred_stats['done']} done | {deferred_stats['failed']} failed""")
+    roster_lines = admin_rosters.status_lines()
+    sections.append(f"<b>👮 Admin Rosters:</b>\n├── {roster_lines[0]}\n└── {roster_lines[1]}")
+    info_lines = chat_info.status_lines()
+    sections.append(f"<b>🪪 Chat Info Cache:</b>\n├── {info_lines[0]}\n└── {info_lines[1]}")
+    convo_lines = chat_history_db.status_lines()
+    sections.append(f"<b>🧠 Conversations:</b>\n├── {convo_lines[0]}\n└── {convo_lines[1]}")
+    cache_lines = [f"├── {line}" for line in ai_cache.status_lines()]
+    cache_lines[-1] = "└" + cache_lines[-1][1:]
+    sections.append("<b>🗃 AI Response Cache:</b>\n" + "\n".join(cache_lines))
+    sections.append("<b>🤖 Model Router:</b>\n" + "\n".join(ai_router.status_lines()))
+    return "\n\n".join(sections)
+
+def metrics_snapshot():
+    # Plain-JSON view of the same numbers, served on /metrics by the health server
+    return {
+        "hunters": {"resident": len(hunter_db), "capacity": hunter_db.capacity, **hunter_db.stats},
+        "persistence": {"queue_depth": pending_count(), "latency_ms": persist_stats["latency"].summary(), **{k: v for k, v in persist_stats.items() if k != "latency"}},
+        "http": {name: {"pool": http_pool_size(name), "latency_ms": st["latency"].summary(), **{k: v for k, v in st.items() if k != "latency"}} for name, st in list(http_stats.items())},
+        "ai": {
+            "replies_today": usage_count["count"],
+            "replies": ai_stats["replies"], "streamed": ai_stats["streamed"], "coalesced": ai_stats["coalesced"],
+            "ttft_ms": ai_stats["ttft"].summary(), "total_ms": ai_stats["total_ms"].summary(), "attempt_ms": ai_stats["attempt_ms"].summary(),
+            "prompt_tokens": ai_stats["prompt_tokens"].summary(), "completion_tokens": ai_stats["completion_tokens"].summary(),
+            "tokens_in": ai_stats["tokens_in"], "tokens_out": ai_stats["tokens_out"], "cost": ai_stats["cost"], "second_sweeps": ai_stats["second_sweeps"],
+            "outcomes": dict(ai_stats["outcomes"]), "attempts": {str(k): v for k, v in ai_stats["attempts"].items()}, "wins": dict(ai_stats["wins"]),
+            "recent": list(ai_stats["recent"])
+        },
+        "admission": {"running": ai_queue.active, "slots": ai_queue.slots, "queued": ai_queue.depth, "wait_ms": ai_queue.wait.summary(), **ai_queue.stats},
+        "models": {m: {"latency_ms": h["latency"].summary(), "results": list(h["results"]), "open_until": h["open_until"], "trips": h["trips"]} for m, h in ai_router.health.items()},
+        "conversations": {"users": len(chat_history_db.users), "tokens": chat_history_db.tokens, **chat_history_db.stats},
+        "response_cache": {"entries": len(ai_cache.entries), "capacity": ai_cache.capacity, "saved_ms": round(ai_cache.saved_ms), "hits": sum(c["hits"] for c in list(ai_cache.chats.values())), "misses": sum(c["misses"] for c in list(ai_cache.chats.values()))},
+        "chat_actions": {"active": len(typing_ticker.chats), **typing_ticker.stats},
+        # Counters only: the job also holds the text, the sender and the last recipient id
+        "broadcast": {k: v for k, v in (broadcast_state["job"] or {}).items() if k in ("phase", "total", "done", "sent", "failed", "blocked", "skipped", "retries", "started")},
+        "webhook": {"mode": RUN_MODE, **webhook_stats},
+        "dungeons": {"active": len(active_dungeons), **dungeon_stats},
+        "admin_rosters": {"chats": len(admin_rosters.chats), **admin_rosters.stats},
+        "chat_info": {"entries": len(chat_info.entries), "capacity": chat_info.capacity, **chat_info.stats},
+        "updates": {"concurrency": UPDATE_CONCURRENCY, "locks": len(keyed_locks.locks), **keyed_locks.stats, "deferred": dict(deferred_stats)}
+    }
+
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in admins_db: 
-        return await update.message.reply_text(premium("<b>❌ Only Bot Admins & Owner can use this.</b> 🤡"), parse_mode="HTML")
+        return await update.message.reply_text(premium_static("<b>❌ Only Bot Admins & Owner can use this.</b> 🤡"), parse_mode="HTML")
     
     if user_id == OWNER_ID:
         buttons = [
             [InlineKeyboardButton("📢 Broadcast", callback_data="broadcast")],
             [InlineKeyboardButton("🌐 List Groups", callback_data="list_groups")],
             [InlineKeyboardButton("➕ Add Bot Admin", callback_data="add_admin"), InlineKeyboardButton("➖ Remove Bot Admin", callback_data="remove_admin")],
-            [InlineKeyboardButton("📋 List Admins", callback_data="list_admins")]
+            [InlineKeyboardButton("📋 List Admins", callback_data="list_admins"), InlineKeyboardButton("📈 System Stats", callback_data="sys_stats")]
         ]
         await update.message.reply_text(premium(f"<b>👑 Owner Panel</b>\n📊 Replies Today: {usage_count['count']} ✨"), reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML")
     else:
         buttons = [
             [InlineKeyboardButton("📢 Broadcast", callback_data="broadcast")],
             [InlineKeyboardButton("🌐 List Groups", callback_data="list_groups")],
-            [InlineKeyboardButton("📋 List Admins", callback_data="list_admins")]
+            [InlineKeyboardButton("📋 List Admins", callback_data="list_admins"), InlineKeyboardButton("📈 System Stats", callback_data="sys_stats")]
         ]
         await update.message.reply_text(premium(f"<b>🛠 Bot Admin Panel</b>\n📊 Replies Today: {usage_count['count']} ✨"), reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML")
 
@@ -1157,11 +2203,11 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
 
     if query.data == "broadcast":
-        await query.message.reply_text(premium("<b>📢 Send me the broadcast message:</b> ✨"), parse_mode="HTML")
+        await query.message.reply_text(premium_static("<b>📢 Send me the broadcast message:</b> ✨"), parse_mode="HTML")
         context.user_data["awaiting_broadcast"] = True
     elif query.data == "list_groups":
-        if not known_groups: return await query.message.reply_text(premium("<b>Bot is not active in any groups yet.</b> 🌸"), parse_mode="HTML")
-        await query.message.reply_text(premium("<b>Fetching group links... please wait.</b> ⏳"), parse_mode="HTML")
+        if not known_groups: return await query.message.reply_text(premium_static("<b>Bot is not active in any groups yet.</b> 🌸"), parse_mode="HTML")
+        await query.message.reply_text(premium_static("<b>Fetching group links... please wait.</b> ⏳"), parse_mode="HTML")
         text = "<b>🌐 Bot Groups & Links:</b>\n\n"
         for cid, title in list(known_groups.items()):
             safe_title = str(title).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -1169,30 +2215,34 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             except: text += f"🔹 {safe_title}: <i>(No Admin Rights)</i>\n"
         for i in range(0, len(text), 4000): await query.message.reply_text(premium(text[i:i+4000]), parse_mode="HTML", disable_web_page_preview=True)
     elif query.data == "add_admin":
-        if user_id != OWNER_ID: return await query.message.reply_text(premium("<b>❌ Only the Owner can add admins.</b> 👑"), parse_mode="HTML")
-        await query.message.reply_text(premium("<b>Send user ID to add as Bot Admin:</b> ✨"), parse_mode="HTML")
+        if user_id != OWNER_ID: return await query.message.reply_text(premium_static("<b>❌ Only the Owner can add admins.</b> 👑"), parse_mode="HTML")
+        await query.message.reply_text(premium_static("<b>Send user ID to add as Bot Admin:</b> ✨"), parse_mode="HTML")
         context.user_data["awaiting_add_admin"] = True
     elif query.data == "remove_admin":
-        if user_id != OWNER_ID: return await query.message.reply_text(premium("<b>❌ Only the Owner can remove admins.</b> 👑"), parse_mode="HTML")
-        await query.message.reply_text(premium("<b>Send user ID to remove from Bot Admins:</b> ✨"), parse_mode="HTML")
+        if user_id != OWNER_ID: return await query.message.reply_text(premium_static("<b>❌ Only the Owner can remove admins.</b> 👑"), parse_mode="HTML")
+        await query.message.reply_text(premium_static("<b>Send user ID to remove from Bot Admins:</b> ✨"), parse_mode="HTML")
         context.user_data["awaiting_remove_admin"] = True
     elif query.data == "list_admins":
         admin_text = "<b>📋 Current Bot Admins:</b>\n\n"
+        await hunter_db.load_many(list(admins_db))
         for aid in admins_db:
             if aid == OWNER_ID:
                 admin_text += f"👑 Owner (<code>{aid}</code>)\n"
             else:
                 if aid in hunter_db:
                     h = hunter_db[aid]
-                    uname = f" {h['username']}" if h.get("username") else ""
-                    admin_text += f"🔹 {h['name']}{uname} (<code>{aid}</code>)\n"
+                    uname = f" {h.username}" if h.username else ""
+                    admin_text += f"🔹 {h.name}{uname} (<code>{aid}</code>)\n"
                 else:
                     admin_text += f"🔹 Unknown Hunter (<code>{aid}</code>)\n"
         await query.message.reply_text(premium(admin_text), parse_mode="HTML")
+    elif query.data == "sys_stats":
+        await query.message.reply_text(premium(system_stats_text()), parse_mode="HTML")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id in blocked_chats: unblock_chat(update.effective_chat.id)
     keyboard = [[InlineKeyboardButton("➕ Add me to your group", url=f"https://t.me/{context.bot.username}?startgroup=true")]]
-    await update.message.reply_text(premium("<b>Hey, I'm CINDRELLA! 🌸</b>\nYour AI Assistant! Type /commands to see what I can do! ✨"), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
+    await update.message.reply_text(premium_static("<b>Hey, I'm CINDRELLA! 🌸</b>\nYour AI Assistant! Type /commands to see what I can do! ✨"), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
 
 async def couple_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -1202,8 +2252,9 @@ async def couple_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text(premium(f"<b>💞 Couple of the Day:</b>\n{mention_html(id1, name1)} + {mention_html(id2, name2)} ✨"), parse_mode="HTML")
 
     members = chat_members_db.get(chat_id, set())
-    pool = [(uid, hunter_db[uid]["name"]) for uid in members if uid in hunter_db]
-    if len(pool) < 2: return await update.message.reply_text(premium("<b>Not enough active members yet! (Thode aur logo ko ek message karne do pehle) ❤️</b>"), parse_mode="HTML")
+    await hunter_db.load_many(list(members))
+    pool = [(uid, hunter_db[uid].name) for uid in members if uid in hunter_db]
+    if len(pool) < 2: return await update.message.reply_text(premium_static("<b>Not enough active members yet! (Thode aur logo ko ek message karne do pehle) ❤️</b>"), parse_mode="HTML")
         
     picked = random.sample(pool, 2)
     couples_db[chat_id] = {"date": today_str, "pair": picked}
@@ -1220,145 +2271,708 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if not member.is_bot:
             username = f"@{member.username}" if member.username else "No Username"
             
-            if member.id not in hunter_db:
-                hunter_db[member.id] = {
-                    "name": _display_name(member), "username": username if member.username else "",
-                    "exp": 0, "last_hunt": 0, "last_daily": "", "crystals": 0, "streak": 0, 
-                    "loot_boxes": 0, "shadows": [], "title": ""
-                }
-            chat_members_db[chat_id].add(member.id)
-            save_hunter(member.id)
+            try:
+                hunter = await hunter_db.ensure(member.id, _display_name(member), username if member.username else "")
+                chat_members_db[chat_id].add(member.id)
+                leaderboards.join(chat_id, hunter)
+                save_hunter(member.id)
+            except HunterStoreError: pass
 
             raw_msg = random.choice(WELCOME_MESSAGES).format(name=_display_name(member))
             final_msg = premium(raw_msg)
             
-            try:
-                safe_name = urllib.parse.quote(_display_name(member))
-                safe_chat = urllib.parse.quote(chat.title or "Our Group")
-                safe_member_count = urllib.parse.quote(f"Member #{member_count}")
-                photos = await context.bot.get_user_profile_photos(member.id, limit=1)
-                avatar_url = "https://i.ibb.co/4pDNDk1/avatar.png" 
-                if photos.total_count > 0: avatar_url = (await context.bot.get_file(photos.photos[0][-1].file_id)).file_path
-                card_url = f"https://api.popcat.xyz/welcomecard?background={urllib.parse.quote(WELCOME_BG_URL)}&text1={safe_name}&text2=Welcome+to+{safe_chat}&text3={safe_member_count}&avatar={urllib.parse.quote(avatar_url)}"
-                await context.bot.send_photo(chat_id=chat_id, photo=card_url, caption=final_msg, parse_mode="HTML")
-            except: 
-                await context.bot.send_message(chat_id=chat_id, text=final_msg, parse_mode="HTML")
+            async with typing_ticker.hold(context.bot, chat_id, ChatAction.UPLOAD_PHOTO):
+                try:
+                    safe_name = urllib.parse.quote(_display_name(member))
+                    safe_chat = urllib.parse.quote(chat.title or "Our Group")
+                    safe_member_count = urllib.parse.quote(f"Member #{member_count}")
+                    photos = await context.bot.get_user_profile_photos(member.id, limit=1)
+                    avatar_url = "https://i.ibb.co/4pDNDk1/avatar.png" 
+                    if photos.total_count > 0: avatar_url = (await context.bot.get_file(photos.photos[0][-1].file_id)).file_path
+                    card_url = f"https://api.popcat.xyz/welcomecard?background={urllib.parse.quote(WELCOME_BG_URL)}&text1={safe_name}&text2=Welcome+to+{safe_chat}&text3={safe_member_count}&avatar={urllib.parse.quote(avatar_url)}"
+                    await context.bot.send_photo(chat_id=chat_id, photo=card_url, caption=final_msg, parse_mode="HTML")
+                except: 
+                    await context.bot.send_message(chat_id=chat_id, text=final_msg, parse_mode="HTML")
 
 # --- 🚀 ULTRA-FAST FAIL-PROOF AI REPLY ---
-ai_queue = asyncio.Semaphore(4)
+# Admission: AI_CONCURRENCY replies run at once. Waiters are queued per chat and
+# per user and served round-robin (chat, then user within the chat), so one busy
+# group or one spammer can't starve everyone else. A user holds at most
+# AI_QUEUE_PER_USER queued-or-running requests, the queue holds at most
+# AI_QUEUE_MAX, and a request still waiting after AI_QUEUE_DEADLINE seconds is
+# shed instead of answered late. With AI_PRIORITY=1 private chats and bot
+# admins are served from a lane ahead of groups.
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "4"))
+AI_QUEUE_MAX = int(os.environ.get("AI_QUEUE_MAX", "64"))
+AI_QUEUE_PER_USER = int(os.environ.get("AI_QUEUE_PER_USER", "2"))
+AI_QUEUE_DEADLINE = float(os.environ.get("AI_QUEUE_DEADLINE", "20"))
+AI_PRIORITY = os.environ.get("AI_PRIORITY", "1") == "1"
+
+class AIScheduler:
+    def __init__(self, slots, max_depth, per_user, deadline):
+        self.slots = slots
+        self.max_depth = max_depth
+        self.per_user = per_user
+        self.deadline = deadline
+        self.active = 0
+        self.depth = 0
+        self.lanes = (OrderedDict(), OrderedDict())
+        self.user_load = defaultdict(int)
+        self.stats = {"admitted": 0, "rejected": 0, "shed": 0}
+        self.wait = RollingWindow()
+
+    def _pop(self):
+        # Round-robin: serve the first chat's first user, then send both to the back
+        for lane in self.lanes:
+            while lane:
+                chat_id, users = next(iter(lane.items()))
+                user_id, waiters = next(iter(users.items()))
+                fut = waiters.popleft()
+                if waiters: users.move_to_end(user_id)
+                else: del users[user_id]
+                if users: lane.move_to_end(chat_id)
+                else: del lane[chat_id]
+                if not fut.done(): return fut
+        return None
+
+    def _handoff(self):
+        # A finished reply passes its slot straight to the next waiter
+        fut = self._pop()
+        if fut is None:
+            self.active -= 1
+            return
+        self.depth -= 1
+        fut.set_result(True)
+
+    def _leave(self, user_id):
+        self.user_load[user_id] -= 1
+        if self.user_load[user_id] <= 0: del self.user_load[user_id]
+
+    @asynccontextmanager
+    async def admit(self, chat_id, user_id, priority=False):
+        # Yields "ok", "busy" (queue full or deadline passed) or "spam" (per-user cap)
+        if self.user_load.get(user_id, 0) >= self.per_user:
+            self.stats["rejected"] += 1
+            yield "spam"
+            return
+        if self.depth >= self.max_depth:
+            self.stats["rejected"] += 1
+            yield "busy"
+            return
+        self.user_load[user_id] += 1
+        queued = time.monotonic()
+        try:
+            if self.active < self.slots and not self.depth:
+                self.active += 1
+            else:
+                fut = asyncio.get_running_loop().create_future()
+                self.lanes[0 if priority else 1].setdefault(chat_id, OrderedDict()).setdefault(user_id, deque()).append(fut)
+                self.depth += 1
+                try:
+                    await asyncio.wait({fut}, timeout=self.deadline)
+                except asyncio.CancelledError:
+                    if fut.done(): self._handoff()
+                    else:
+                        fut.cancel()
+                        self.depth -= 1
+                    raise
+                if not fut.done():
+                    fut.cancel()
+                    self.depth -= 1
+                    self.stats["shed"] += 1
+                    yield "busy"
+                    return
+            self.stats["admitted"] += 1
+            self.wait.add((time.monotonic() - queued) * 1000)
+            try: yield "ok"
+            finally: self._handoff()
+        finally:
+            self._leave(user_id)
+
+    def status_lines(self):
+        return [f"<b>Running:</b> {self.active}/{self.slots} | <b>Queued:</b> {self.depth}/{self.max_depth}",
+                f"<b>Admitted:</b> {self.stats['admitted']} | <b>Rejected:</b> {self.stats['rejected']} | <b>Shed:</b> {self.stats['shed']}",
+                f"<b>Queue Wait:</b> p50 {self.wait.percentile(50):.0f}ms | p95 {self.wait.percentile(95):.0f}ms"]
+
+ai_queue = AIScheduler(AI_CONCURRENCY, AI_QUEUE_MAX, AI_QUEUE_PER_USER, AI_QUEUE_DEADLINE)
+
+# Hedging: ask the preferred model, and if it hasn't answered within
+# AI_HEDGE_DELAY seconds fire the next one too; the first good answer wins and
+# the rest are cancelled. AI_HEDGE_DELAY=0 restores the plain sequential loop.
+AI_HEDGE_DELAY = float(os.environ.get("AI_HEDGE_DELAY", "2.0"))
+AI_MAX_INFLIGHT = int(os.environ.get("AI_MAX_INFLIGHT", "2"))
+
+# Streaming: the reply is sent as soon as the first tokens arrive and then edited
+# in place at most once per AI_STREAM_EDIT_INTERVAL (Telegram throttles edits,
+# harder in groups). Hedging then races models on time-to-first-token.
+AI_STREAM = os.environ.get("AI_STREAM", "0") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.environ.get("AI_STREAM_EDIT_INTERVAL", "1.5"))
+ai_stats = {
+    "replies": 0, "streamed": 0, "coalesced": 0, "ttft": RollingWindow(),
+    "total_ms": RollingWindow(), "attempt_ms": RollingWindow(),
+    "prompt_tokens": RollingWindow(), "completion_tokens": RollingWindow(),
+    "tokens_in": 0, "tokens_out": 0, "cost": 0.0, "second_sweeps": 0,
+    "outcomes": defaultdict(int), "attempts": defaultdict(int), "wins": defaultdict(int),
+    "recent": deque(maxlen=50)
+}
+
+# Per-request telemetry. ai_reply puts a trace in the ai_trace context variable;
+# model attempts (including hedged ones, which inherit the context) append to it
+# and finish_trace() folds it into the rolling windows in ai_stats.
+ai_trace = ContextVar("ai_trace", default=None)
+
+def record_attempt(model, status, latency_ms, usage=None):
+    trace = ai_trace.get()
+    if trace is None: return
+    trace["attempts"].append({"model": model, "status": status, "ms": round(latency_ms)})
+    if usage: trace["usage"] = usage
+
+def finish_trace(trace, outcome):
+    trace["outcome"] = outcome
+    trace["total_ms"] = round((time.perf_counter() - trace["started"]) * 1000)
+    ai_stats["outcomes"][outcome] += 1
+    if outcome in ("ok", "cache"): ai_stats["total_ms"].add(trace["total_ms"])
+    if trace["sweeps"] > 1: ai_stats["second_sweeps"] += 1
+    for attempt in trace["attempts"]:
+        ai_stats["attempts"][attempt["status"]] += 1
+        if attempt["status"] != "cancelled": ai_stats["attempt_ms"].add(attempt["ms"])
+    if trace["model"]: ai_stats["wins"][trace["model"]] += 1
+    usage = trace["usage"] or {}
+    if usage:
+        ai_stats["prompt_tokens"].add(usage.get("prompt_tokens", 0))
+        ai_stats["completion_tokens"].add(usage.get("completion_tokens", 0))
+        ai_stats["tokens_in"] += usage.get("prompt_tokens", 0)
+        ai_stats["tokens_out"] += usage.get("completion_tokens", 0)
+        ai_stats["cost"] += usage.get("cost") or 0
+    ai_stats["recent"].append({k: v for k, v in trace.items() if k != "started"})
+
+# Conversation memory: each user keeps the most recent turns that fit in
+# AI_HISTORY_TOKENS (estimated at ~4 chars per token) and the whole store stays
+# under AI_HISTORY_TOTAL_TOKENS by dropping the least recently active users.
+# With AI_HISTORY_SUMMARY=1 turns that fall off are folded into a short note of
+# what the user said, so names and places survive a long chat.
+AI_HISTORY_TOKENS = int(os.environ.get("AI_HISTORY_TOKENS", "2000"))
+AI_HISTORY_TOTAL_TOKENS = int(os.environ.get("AI_HISTORY_TOTAL_TOKENS", "1500000"))
+AI_HISTORY_SUMMARY = os.environ.get("AI_HISTORY_SUMMARY", "1") == "1"
+AI_HISTORY_SUMMARY_CHARS = int(os.environ.get("AI_HISTORY_SUMMARY_CHARS", "400"))
+
+def estimate_tokens(text):
+    return len(text) // 4 + 4
+
+class Conversation:
+    __slots__ = ("turns", "tokens", "summary")
+
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = ""
+
+    def __len__(self):
+        return len(self.turns)
+
+    def tail(self, n):
+        return tuple(content for _, content in list(self.turns)[-n:])
+
+class ConversationStore:
+    def __init__(self, budget, total_budget, compact):
+        self.users = OrderedDict()
+        self.budget = budget
+        self.total_budget = total_budget
+        self.compact = compact
+        self.tokens = 0
+        self.stats = {"evictions": 0, "compactions": 0}
+
+    def peek(self, user_id):
+        return self.users.get(user_id)
+
+    def messages(self, user_id):
+        convo = self.users.get(user_id)
+        if convo is None: return []
+        self.users.move_to_end(user_id)
+        history = [{"role": "system", "content": f"Earlier in this chat the user said: {convo.summary}"}] if convo.summary else []
+        history.extend({"role": role, "content": content} for role, content in convo.turns)
+        return history
+
+    def add(self, user_id, user_text, reply):
+        convo = self.users.get(user_id)
+        if convo is None: convo = self.users[user_id] = Conversation()
+        self.users.move_to_end(user_id)
+        before = convo.tokens
+        for role, content in (("user", user_text), ("assistant", reply)):
+            convo.turns.append((role, content))
+            convo.tokens += estimate_tokens(content)
+        # Always keep the latest exchange, however long it was
+        while convo.tokens > self.budget and len(convo.turns) > 2:
+            role, content = convo.turns.popleft()
+            convo.tokens -= estimate_tokens(content)
+            if self.compact and role == "user": self._fold(convo, content)
+        self.tokens += convo.tokens - before
+        while self.tokens > self.total_budget and len(self.users) > 1:
+            _, old = self.users.popitem(last=False)
+            self.tokens -= old.tokens
+            self.stats["evictions"] += 1
+
+    def _fold(self, convo, content):
+        note = " ".join(content.split())[:80]
+        summary = f"{convo.summary} | {note}" if convo.summary else note
+        if len(summary) > AI_HISTORY_SUMMARY_CHARS:
+            summary = summary[-AI_HISTORY_SUMMARY_CHARS:].partition(" | ")[2] or summary[-AI_HISTORY_SUMMARY_CHARS:]
+        convo.tokens += estimate_tokens(summary) - (estimate_tokens(convo.summary) if convo.summary else 0)
+        convo.summary = summary
+        self.stats["compactions"] += 1
+
+    def status_lines(self):
+        return [f"<b>Users:</b> {len(self.users)} | <b>Tokens:</b> {self.tokens}/{self.total_budget} (~{self.tokens * 4 // 1024} KiB text)",
+                f"<b>Evicted:</b> {self.stats['evictions']} | <b>Compacted Turns:</b> {self.stats['compactions']}"]
+
+chat_history_db = ConversationStore(AI_HISTORY_TOKENS, AI_HISTORY_TOTAL_TOKENS, AI_HISTORY_SUMMARY)
+
+# Short prompts with little or no history ("hi", "who are you") get the same
+# answer over and over; serve those from memory without a queue slot or an
+# upstream call. AI_CACHE_SIZE=0 turns it off.
+AI_CACHE_SIZE = int(os.environ.get("AI_CACHE_SIZE", "256"))
+AI_CACHE_TTL = float(os.environ.get("AI_CACHE_TTL", "600"))
+AI_CACHE_MAX_PROMPT = int(os.environ.get("AI_CACHE_MAX_PROMPT", "60"))
+AI_CACHE_MAX_HISTORY = int(os.environ.get("AI_CACHE_MAX_HISTORY", "2"))
+
+class ResponseCache:
+    def __init__(self, capacity, ttl):
+        self.entries = OrderedDict()
+        self.capacity = capacity
+        self.ttl = ttl
+        self.chats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.saved_ms = 0.0
+
+    def key(self, text, convo):
+        # None means "don't cache": off, prompt too long, or a real conversation
+        if not self.capacity or (convo and (convo.summary or len(convo) > AI_CACHE_MAX_HISTORY)): return None
+        prompt = " ".join(re.sub(r"@\w+|[^\w\s]", " ", text.lower()).split())
+        if not prompt or len(prompt) > AI_CACHE_MAX_PROMPT: return None
+        return prompt, hash(convo.tail(2) if convo else ())
+
+    def get(self, chat_id, key):
+        if key is None: return None
+        entry = self.entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.chats[chat_id]["hits"] += 1
+            self.saved_ms += ai_stats["ttft"].percentile(50)
+            return entry[0]
+        if entry: del self.entries[key]
+        self.chats[chat_id]["misses"] += 1
+        return None
+
+    def put(self, key, reply):
+        if key is None: return
+        self.entries[key] = (reply, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def status_lines(self):
+        hits = sum(c["hits"] for c in self.chats.values())
+        total = hits + sum(c["misses"] for c in self.chats.values())
+        lines = [f"<b>Entries:</b> {len(self.entries)}/{self.capacity} | <b>Hit Rate:</b> {hits * 100 // (total or 1)}% ({hits}/{total}) | <b>Saved:</b> ~{self.saved_ms / 1000:.0f}s"]
+        top = sorted(self.chats.items(), key=lambda item: item[1]["hits"], reverse=True)[:5]
+        lines += [f"<code>{chat_id}</code> {c['hits']} hits / {c['misses']} misses" for chat_id, c in top if c["hits"]]
+        return lines
+
+ai_cache = ResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+
+AI_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}", 
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://t.me/CindrellaBot",
+    "X-Title": "Cindrella Bot"
+}
+
+AI_SYSTEM_PROMPT = "You are CINDRELLA, an exceptionally smart, caring, and witty AI companion. Speak naturally like a close best friend. CRITICAL RULES: 1. Reply in the exact same language and script the user uses (Hindi, Hinglish, or English). 2. Keep responses concise (1-3 lines). 3. You MUST remember all details, names, and places the user mentioned earlier. 4. Do not act like a bot. 5. Use basic emojis (like 🌸, ❤️, 🥺, ✨, 🎀, 🦋, 💖, 💗, 💕, 😊, 🥰, 😭, 🔥, 😂, 🤣, 👍, ✅, ❌, ⚠️, 👑, 🤍, 🩷, 😅, ☕️, 🧸). I will handle replacing them with premium aesthetic versions."
+
+AI_MODELS = [
+    "meta-llama/llama-3.3-70b-instruct:free", 
+    "google/gemma-4-31b-it:free",
+    "google/gemma-4-26b-a4b-it:free",
+    "z-ai/glm-4.5-air:free",
+    "baidu/qianfan-ocr-fast:free"
+]
+
+# Rolling health per model. Candidates are ordered by expected time-to-answer
+# (success rate x p50 latency, with failures costing a full timeout) and a model
+# that keeps failing is skipped by a circuit breaker with exponential backoff.
+AI_TIMEOUT_MS = HTTP_HOSTS["openrouter"]["timeout"] * 1000
+AI_ROUTER_WINDOW = int(os.environ.get("AI_ROUTER_WINDOW", "50"))
+AI_BREAKER_THRESHOLD = int(os.environ.get("AI_BREAKER_THRESHOLD", "3"))
+AI_BREAKER_BASE = float(os.environ.get("AI_BREAKER_BASE", "30"))
+AI_BREAKER_MAX = float(os.environ.get("AI_BREAKER_MAX", "900"))
+
+class ModelRouter:
+    def __init__(self, models):
+        self.models = list(models)
+        self.health = {m: {"results": deque(maxlen=AI_ROUTER_WINDOW), "latency": RollingWindow(AI_ROUTER_WINDOW), "failures": 0, "trips": 0, "open_until": 0.0} for m in self.models}
+
+    def record(self, model, ok, status, latency_ms):
+        h = self.health[model]
+        h["results"].append(200 if ok else status)
+        if ok:
+            h["latency"].add(latency_ms)
+            h.update({"failures": 0, "trips": 0, "open_until": 0.0})
+            return
+        h["failures"] += 1
+        # A model that already tripped gets no grace period on its probe request
+        if h["failures"] >= AI_BREAKER_THRESHOLD or h["trips"]:
+            h["open_until"] = time.time() + min(AI_BREAKER_MAX, AI_BREAKER_BASE * 2 ** h["trips"])
+            h["trips"] += 1
+            h["failures"] = 0
+
+    def expected_ms(self, model):
+        h = self.health[model]
+        ok = sum(1 for r in h["results"] if r == 200)
+        success = (ok + 1) / (len(h["results"]) + 2)
+        p50 = h["latency"].percentile(50) if len(h["latency"]) else AI_TIMEOUT_MS / 3
+        return success * p50 + (1 - success) * AI_TIMEOUT_MS
+
+    def candidates(self):
+        now = time.time()
+        closed = [m for m in self.models if self.health[m]["open_until"] <= now]
+        if not closed: return [min(self.models, key=lambda m: self.health[m]["open_until"])]
+        return sorted(closed, key=self.expected_ms)
+
+    def status_lines(self):
+        now, lines = time.time(), []
+        for m in self.models:
+            h = self.health[m]
+            n = len(h["results"]) or 1
+            ok = sum(1 for r in h["results"] if r == 200) * 100 // n
+            limited = sum(1 for r in h["results"] if r == 429) * 100 // n
+            state = f"⛔ open {int(h['open_until'] - now)}s" if h["open_until"] > now else ("🟡 probing" if h["trips"] else "✅")
+            if not h["results"]:
+                lines.append(f"<code>{m.split('/')[-1]}</code> {state} | no data yet")
+                continue
+            lines.append(f"<code>{m.split('/')[-1]}</code> {state} | ok {ok}% | 429 {limited}% | p50 {h['latency'].percentile(50):.0f}ms p95 {h['latency'].percentile(95):.0f}ms")
+        return lines
+
+def ai_payload(model, messages, stream=False):
+    payload = {
+        "model": model, 
+        "messages": messages,
+        "temperature": 0.6,
+        "frequency_penalty": 0.0,
+        "presence_penalty": 0.0
+    }
+    if stream: payload["stream"] = True
+    payload["usage"] = {"include": True}
+    return payload
+
+async def ask_model(model, messages):
+    reply, status, usage, start = None, None, None, time.perf_counter()
+    try:
+        res = await http_request("openrouter", "POST", "/chat/completions", headers=AI_HEADERS, json=ai_payload(model, messages))
+        status = res.status_code
+        if status == 200:
+            data = res.json()
+            usage = data.get("usage")
+            if "choices" in data and len(data["choices"]) > 0:
+                reply = data["choices"][0]["message"]["content"].strip()
+    except asyncio.CancelledError:
+        record_attempt(model, "cancelled", (time.perf_counter() - start) * 1000)
+        raise
+    except Exception: pass
+    latency_ms = (time.perf_counter() - start) * 1000
+    ai_router.record(model, bool(reply), status, latency_ms)
+    record_attempt(model, status if reply or status != 200 else "empty", latency_ms, usage)
+    if reply and ai_trace.get(): ai_trace.get()["model"] = model
+    return reply, status
+
+def sse_chunk(line):
+    # {} for keep-alives and junk, None once the stream says [DONE]
+    if not line.startswith("data:"): return {}
+    data = line[5:].strip()
+    if data == "[DONE]": return None
+    try: return json.loads(data)
+    except ValueError: return {}
+
+def chunk_text(chunk):
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+class ModelStream:
+    def __init__(self, response, lines, first):
+        self.response = response
+        self.lines = lines
+        self.first = first
+        self.complete = False
+
+    async def chunks(self):
+        # OpenRouter puts token usage on the last chunk
+        yield self.first
+        async for line in self.lines:
+            chunk = sse_chunk(line)
+            if chunk is None:
+                self.complete = True
+                break
+            if chunk.get("usage") and ai_trace.get(): ai_trace.get()["usage"] = chunk["usage"]
+            text = chunk_text(chunk)
+            if text: yield text
+
+    async def close(self):
+        await self.response.aclose()
+
+async def open_stream(model, messages):
+    # Same contract as ask_model, but "answered" means the first content token
+    # arrived; the router records time-to-first-token for streamed calls.
+    stream, status, res, start = None, None, None, time.perf_counter()
+    try:
+        res = await http_request("openrouter", "POST", "/chat/completions", stream=True, headers=AI_HEADERS, json=ai_payload(model, messages, stream=True))
+        status = res.status_code
+        if status == 200:
+            lines = res.aiter_lines()
+            async for line in lines:
+                chunk = sse_chunk(line)
+                if chunk is None: break
+                text = chunk_text(chunk)
+                if text:
+                    stream = ModelStream(res, lines, text.lstrip() or text)
+                    break
+    except asyncio.CancelledError:
+        record_attempt(model, "cancelled", (time.perf_counter() - start) * 1000)
+        if res is not None: await res.aclose()
+        raise
+    except Exception: pass
+    if stream is None and res is not None: await res.aclose()
+    latency_ms = (time.perf_counter() - start) * 1000
+    ai_router.record(model, stream is not None, status, latency_ms)
+    record_attempt(model, status if stream or status != 200 else "empty", latency_ms)
+    if stream and ai_trace.get(): ai_trace.get()["model"] = model
+    return stream, status
+
+async def close_stream(stream):
+    await stream.close()
+
+async def ask_sequential(models, messages, attempt=ask_model, discard=None):
+    for model in models:
+        reply, status = await attempt(model, messages)
+        if reply: return reply
+        if status == 429: await asyncio.sleep(1)
+    return None
+
+async def ask_hedged(models, messages, attempt=ask_model, discard=None):
+    # discard() releases a winner that lost the race by finishing in the same tick
+    queue, pending = list(models), set()
+    try:
+        while queue or pending:
+            if queue and len(pending) < AI_MAX_INFLIGHT:
+                pending.add(asyncio.create_task(attempt(queue.pop(0), messages)))
+            can_hedge = queue and len(pending) < AI_MAX_INFLIGHT
+            done, pending = await asyncio.wait(pending, timeout=AI_HEDGE_DELAY if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task.result()[0] for task in done if not task.exception() and task.result()[0]]
+            if winners:
+                for extra in winners[1:]:
+                    if discard: await discard(extra)
+                return winners[0]
+        return None
+    finally:
+        for task in pending:
+            # cancel() is False only if the attempt finished while we were discarding
+            if not task.cancel() and discard and not task.exception() and task.result()[0]:
+                spawn(discard(task.result()[0]))
+
+ai_router = ModelRouter(AI_MODELS)
+
+def stream_preview(text):
+    # What a partial reply may show: asterisks gone, half-arrived emoji held back
+    text = text.replace("*", "")
+    for size in range(min(EMOJI_PREFIX_MAX, len(text)), 0, -1):
+        if text[-size:] in EMOJI_PREFIXES:
+            text = text[:-size]
+            break
+    return text.strip()
+
+async def send_bold(update, context, text):
+    bold_reply = f"<b>{rewrite_emoji(text)}</b>"
+    try: return await update.message.reply_text(bold_reply, parse_mode="HTML")
+    except BadRequest: return await context.bot.send_message(chat_id=update.effective_chat.id, text=bold_reply, parse_mode="HTML")
+
+async def stream_reply(update, context, stream, started):
+    text, shown, sent, next_edit = "", "", None, 0.0
+    try:
+        async for chunk in stream.chunks():
+            text += chunk
+            preview = stream_preview(text)
+            if not preview or preview == shown or time.monotonic() < next_edit: continue
+            try:
+                if sent is None:
+                    sent = await send_bold(update, context, preview)
+                    ai_stats["ttft"].add((time.perf_counter() - started) * 1000)
+                else:
+                    await sent.edit_text(f"<b>{rewrite_emoji(preview)}</b>", parse_mode="HTML")
+            except RetryAfter as e:
+                next_edit = time.monotonic() + e.retry_after
+                continue
+            except BadRequest: pass
+            except TelegramError:
+                # A timed-out edit is skipped, not fatal; the tokens keep coming
+                next_edit = time.monotonic() + AI_STREAM_EDIT_INTERVAL
+                continue
+            shown, next_edit = preview, time.monotonic() + AI_STREAM_EDIT_INTERVAL
+    except Exception: pass  # a dropped stream still ends with whatever arrived
+    finally:
+        await stream.close()
+
+    reply = text.strip().replace("**", "").replace("*", "")
+    if not reply: return None
+    if sent is None:
+        await send_bold(update, context, reply)
+        ai_stats["ttft"].add((time.perf_counter() - started) * 1000)
+    elif reply != shown:
+        for _ in range(2):
+            try: await sent.edit_text(f"<b>{rewrite_emoji(reply)}</b>", parse_mode="HTML")
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except BadRequest: pass
+            break
+    ai_stats["streamed"] += 1
+    return reply
+
+async def ai_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, batch=None):
+    # batch is the debounce entry this reply answers; see queue_ai_reply()
+    started = batch["last"] if batch else time.perf_counter()
+    trace = {"started": started, "chat_type": update.effective_chat.type, "queue_ms": None, "attempts": [], "sweeps": 0, "model": None, "usage": None}
+    ai_trace.set(trace)
+    outcome = "error"
+    try:
+        outcome = await answer_ai(update, context, batch, trace)
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        finish_trace(trace, outcome)
 
-async def ai_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message_text = update.message.text
+async def answer_ai(update, context, batch, trace):
+    # Returns the outcome recorded in the trace
+    message_text = "\n".join(batch["texts"]) if batch else update.message.text
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    
-    async def keep_typing():
-        while True:
-            try:
-                await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            except: pass
-            await asyncio.sleep(4)
+    started = trace["started"]
+    
+    cache_key = ai_cache.key(message_text, chat_history_db.peek(user_id))
+    cached = ai_cache.get(chat_id, cache_key)
+    if cached:
+        if batch: batch["delivering"] = True
+        ai_stats["replies"] += 1
+        await send_bold(update, context, cached)
+        ai_stats["ttft"].add((time.perf_counter() - started) * 1000)
+        chat_history_db.add(user_id, message_text, cached)
+        return "cache"
+    
+    priority = AI_PRIORITY and (update.effective_chat.type == "private" or user_id in admins_db)
+    queued = time.perf_counter()
+    async with typing_ticker.hold(context.bot, chat_id):
+        async with ai_queue.admit(chat_id, user_id, priority) as admission:
+            trace["queue_ms"] = round((time.perf_counter() - queued) * 1000)
+            if admission == "busy":
+                try: await update.message.reply_text(premium_static("<b>Abhi bahut saare log baat kar rahe hain babu... thodi der baad try karna! 🥺🌸</b>"), parse_mode="HTML")
+                except: pass
+            if admission != "ok": return admission
             
-    typing_task = asyncio.create_task(keep_typing())
-    
-    try:
-        async with ai_queue:
             if usage_count["date"] != str(date.today()): usage_count.update({"date": str(date.today()), "count": 0})
             
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}", 
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://t.me/CindrellaBot",
-                "X-Title": "Cindrella Bot"
-            }
-            
-            system_prompt = "You are CINDRELLA, an exceptionally smart, caring, and witty AI companion. Speak naturally like a close best friend. CRITICAL RULES: 1. Reply in the exact same language and script the user uses (Hindi, Hinglish, or English). 2. Keep responses concise (1-3 lines). 3. You MUST remember all details, names, and places the user mentioned earlier. 4. Do not act like a bot. 5. Use basic emojis (like 🌸, ❤️, 🥺, ✨, 🎀, 🦋, 💖, 💗, 💕, 😊, 🥰, 😭, 🔥, 😂, 🤣, 👍, ✅, ❌, ⚠️, 👑, 🤍, 🩷, 😅, ☕️, 🧸). I will handle replacing them with premium aesthetic versions."
-            
-            models = [
-                "meta-llama/llama-3.3-70b-instruct:free", 
-                "google/gemma-4-31b-it:free",
-                "google/gemma-4-26b-a4b-it:free",
-                "z-ai/glm-4.5-air:free",
-                "baidu/qianfan-ocr-fast:free"
-            ]
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(chat_history_db[user_id][-30:])
+            messages = [{"role": "system", "content": AI_SYSTEM_PROMPT}]
+            messages.extend(chat_history_db.messages(user_id))
             messages.append({"role": "user", "content": message_text})
             
-            success = False
-            reply = ""
-            
+            # Streamed replies are already on screen when ask() returns
+            reply, complete = None, True
+            ask = ask_hedged if AI_HEDGE_DELAY > 0 else ask_sequential
             for sweep in range(2):
-                if success: break
-                for model in models:
-                    try:
-                        payload = {
-                            "model": model, 
-                            "messages": messages,
-                            "temperature": 0.6,
-                            "frequency_penalty": 0.0,
-                            "presence_penalty": 0.0
-                        }
-                        async with httpx.AsyncClient(timeout=6) as client:
-                            res = await client.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
-                            
-                            if res.status_code == 200:
-                                data = res.json()
-                                if "choices" in data and len(data["choices"]) > 0:
-                                    reply = data["choices"][0]["message"]["content"].strip()
-                                    success = True
-                                    break
-                            elif res.status_code == 429:
-                                await asyncio.sleep(1) 
-                            else:
-                                continue
-                    except: 
-                        continue
-                if not success:
-                    await asyncio.sleep(1)
+                trace["sweeps"] = sweep + 1
+                if AI_STREAM:
+                    stream = await ask(ai_router.candidates(), messages, attempt=open_stream, discard=close_stream)
+                    if stream:
+                        if batch: batch["delivering"] = True
+                        reply = await stream_reply(update, context, stream, started)
+                        complete = stream.complete
+                else:
+                    reply = await ask(ai_router.candidates(), messages)
+                if reply: break
+                await asyncio.sleep(1)
                     
-            if success:
-                reply = reply.replace("**", "").replace("*", "")
-                premium_reply = premium(reply)
-                bold_reply = f"<b>{premium_reply}</b>"
-                
+            if reply:
                 usage_count["count"] += 1
+                ai_stats["replies"] += 1
                 
-                chat_history_db[user_id].append({"role": "user", "content": message_text})
-                chat_history_db[user_id].append({"role": "assistant", "content": reply})
-                if len(chat_history_db[user_id]) > 60:
-                    chat_history_db[user_id] = chat_history_db[user_id][-60:]
-                    
-                try: await update.message.reply_text(bold_reply, parse_mode="HTML")
-                except BadRequest: await context.bot.send_message(chat_id=chat_id, text=bold_reply, parse_mode="HTML")
+                if not AI_STREAM:
+                    if batch: batch["delivering"] = True
+                    reply = reply.replace("**", "").replace("*", "")
+                    await send_bold(update, context, reply)
+                    ai_stats["ttft"].add((time.perf_counter() - started) * 1000)
+                
+                # A stream cut off mid-reply stays on screen but is never served again
+                if complete: ai_cache.put(cache_key, reply)
+                chat_history_db.add(user_id, message_text, reply)
+                return "ok" if complete else "partial"
             else:
-                fallback = premium("<b>Oops! Mera network thoda slow chal raha hai babu... ek minute baad try karna! 🥺🌸</b>")
+                fallback = premium_static("<b>Oops! Mera network thoda slow chal raha hai babu... ek minute baad try karna! 🥺🌸</b>")
                 try: await update.message.reply_text(fallback, parse_mode="HTML")
                 except: await context.bot.send_message(chat_id=chat_id, text=fallback, parse_mode="HTML")
+                return "failed"
+
+# Debounce: a thought typed as three quick messages gets one answer. Each new
+# message restarts the user's AI_DEBOUNCE window and, unless the previous reply
+# is already being delivered, cancels it and folds its text into the new batch.
+AI_DEBOUNCE = float(os.environ.get("AI_DEBOUNCE", "1.5"))
+pending_ai = {}
+
+def queue_ai_reply(update, context):
+    key = (update.effective_chat.id, update.effective_user.id)
+    texts = [update.message.text]
+    old = pending_ai.get(key)
+    if old and not old["delivering"] and not old["task"].done():
+        old["task"].cancel()
+        texts = old["texts"] + texts
+        ai_stats["coalesced"] += 1
+    batch = pending_ai[key] = {"texts": texts, "last": time.perf_counter(), "delivering": False}
+    batch["task"] = asyncio.create_task(debounced_reply(key, update, context, batch))
+
+async def debounced_reply(key, update, context, batch):
+    try:
+        if AI_DEBOUNCE > 0: await asyncio.sleep(AI_DEBOUNCE)
+        await ai_reply(update, context, batch)
     finally:
-        typing_task.cancel()
+        if pending_ai.get(key) is batch: del pending_ai[key]
 
 # ------------- CORE TEXT HANDLER -------------
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # A user's messages are handled one at a time so a give can't be typed twice
+    # into the same prompt while the target loads
+    if not update.message or not update.message.text or not update.effective_user: return
+    async with keyed_locks.hold(("hunter", update.effective_user.id)):
+        await process_text(update, context)
+
+async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text: return
     chat_id, user, msg_lower = update.effective_chat.id, update.effective_user, update.message.text.lower()
     
     recent_messages_db[chat_id].append((update.message.message_id, user.id))
+    if chat_id in blocked_chats: unblock_chat(chat_id)
     
-    ensure_user_registered(update)
+    # With the database down only the hunter steps (gives, EXP) are skipped;
+    # spam, blacklist and filters still run on every message
+    try:
+        await ensure_user_registered(update)
+        registered = True
+    except HunterStoreError: registered = False
     
-    if context.user_data.get("awaiting_give_shadow"):
+    if registered and context.user_data.get("awaiting_give_shadow"):
         shadow_name = update.message.text.strip()
         target_id = context.user_data["give_target_id"]
         target_name = context.user_data["give_target_name"]
         
+        try: target_data = await hunter_db.ensure(target_id, target_name)
+        except HunterStoreError: return await update.message.reply_text(premium_static("<b>❌ Hunter data unavailable, send the name again!</b> ⚠️"), parse_mode="HTML")
         sender_data = hunter_db[user.id]
-        if target_id not in hunter_db:
-            hunter_db[target_id] = {"name": target_name, "username": "", "exp": 0, "last_hunt": 0, "last_daily": "", "crystals": 0, "streak": 0, "loot_boxes": 0, "shadows": [], "title": ""}
-        target_data = hunter_db[target_id]
         
-        s_shadows = sender_data.get("shadows", [])
+        s_shadows = sender_data.shadow_names()
         if user.id == OWNER_ID: s_shadows = ALL_SHADOWS
             
         matched_shadow = next((s for s in s_shadows if s.lower() == shadow_name.lower()), None)
@@ -1369,9 +2983,9 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return await update.message.reply_text(premium(f"<b>❌ Tumhare paas '{shadow_name}' naam ka koi Shadow nahi hai. Transaction cancelled.</b> 🤡"), parse_mode="HTML")
             
         if user.id != OWNER_ID:
-            sender_data["shadows"].remove(matched_shadow)
+            sender_data.remove_shadow(matched_shadow)
             
-        target_data["shadows"].append(matched_shadow)
+        target_data.add_shadow(matched_shadow)
         save_hunter(user.id)
         save_hunter(target_id)
         
@@ -1380,7 +2994,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         return await update.message.reply_text(premium(f"<b>✅ SHADOW TRANSFERRED!</b>\n\n🌑 You gave <b>{matched_shadow}</b> to {target_name}! ✨"), parse_mode="HTML")
 
-    if context.user_data.get("awaiting_give_amount"):
+    if registered and context.user_data.get("awaiting_give_amount"):
         amount_str = update.message.text.strip()
         if amount_str.isdigit() and int(amount_str) > 0:
             amount = int(amount_str)
@@ -1388,22 +3002,21 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             target_id = context.user_data["give_target_id"]
             target_name = context.user_data["give_target_name"]
             
+            try: target_data = await hunter_db.ensure(target_id, target_name)
+            except HunterStoreError: return await update.message.reply_text(premium_static("<b>❌ Hunter data unavailable, send the amount again!</b> ⚠️"), parse_mode="HTML")
             sender_data = hunter_db[user.id]
-            if target_id not in hunter_db:
-                hunter_db[target_id] = {"name": target_name, "username": "", "exp": 0, "last_hunt": 0, "last_daily": "", "crystals": 0, "streak": 0, "loot_boxes": 0, "shadows": [], "title": ""}
-            target_data = hunter_db[target_id]
             
             db_keys = {"exp": "exp", "crystals": "crystals", "lootbox": "loot_boxes"}
             db_key = db_keys[item_type]
             item_names = {"exp": "EXP ⚡", "crystals": "Magic Crystals 🔮", "lootbox": "S-Rank Loot Boxes 🧰"}
             
             if user.id != OWNER_ID:
-                if sender_data.get(db_key, 0) < amount:
+                if getattr(sender_data, db_key) < amount:
                     context.user_data.pop("awaiting_give_amount", None)
                     return await update.message.reply_text(premium(f"<b>❌ Tumhare paas itne {item_names[item_type]} nahi hain!</b> 🥺"), parse_mode="HTML")
-                sender_data[db_key] -= amount
+                setattr(sender_data, db_key, getattr(sender_data, db_key) - amount)
                 
-            target_data[db_key] += amount
+            setattr(target_data, db_key, getattr(target_data, db_key) + amount)
             save_hunter(user.id)
             save_hunter(target_id)
             
@@ -1416,7 +3029,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data.pop("awaiting_give_amount", None)
             context.user_data.pop("give_target_id", None)
             context.user_data.pop("give_item", None)
-            return await update.message.reply_text(premium("<b>❌ Invalid amount. Transaction cancelled.</b> 🤡"), parse_mode="HTML")
+            return await update.message.reply_text(premium_static("<b>❌ Invalid amount. Transaction cancelled.</b> 🤡"), parse_mode="HTML")
     
     if chat_id in active_dungeons and active_dungeons[chat_id]["type"] == 2:
         if update.message.reply_to_message and update.message.reply_to_message.message_id == active_dungeons[chat_id]["msg_id"]:
@@ -1432,40 +3045,29 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if chat_id not in active_dungeons:
                 asyncio.create_task(spawn_dungeon(update, context, chat_id))
 
-    if user.id != OWNER_ID:
-        hunter_db[user.id]["exp"] += 5 
-        if (hunter_db[user.id]["exp"] // 5) % 5 == 0: 
+    if registered and user.id != OWNER_ID:
+        hunter_db[user.id].exp += 5 
+        if (hunter_db[user.id].exp // 5) % 5 == 0: 
             save_hunter(user.id)
 
     if user.id in admins_db:
         if context.user_data.pop("awaiting_broadcast", None):
-            success_groups = 0
-            for cid in list(known_groups.keys()):
-                try: 
-                    await context.bot.send_message(cid, premium(f"<b>📢 Broadcast Message:</b>\n\n{update.message.text} ✨"), parse_mode="HTML")
-                    success_groups += 1
-                    await asyncio.sleep(0.05)
-                except: pass
-            
-            success_users = 0
-            for uid in list(hunter_db.keys()):
-                try:
-                    await context.bot.send_message(uid, premium(f"<b>📢 System Broadcast:</b>\n\n{update.message.text} 🌸"), parse_mode="HTML")
-                    success_users += 1
-                    await asyncio.sleep(0.05)
-                except: pass
-                
-            return await update.message.reply_text(premium(f"<b>✅ Broadcast successfully sent to {success_groups} Groups and {success_users} Users DMs!</b> 🎉"), parse_mode="HTML")
+            if broadcast_state["job"]:
+                return await update.message.reply_text(premium_static("<b>⏳ A broadcast is already running.</b> Check 📈 System Stats for progress. ✨"), parse_mode="HTML")
+            job = new_broadcast(update.message.text, user.id)
+            await save_broadcast(job)
+            start_broadcast(context.bot, job)
+            return await update.message.reply_text(premium(f"<b>🚀 Broadcast started to {len(known_groups)} Groups and all Hunters!</b> I'll message you when it's done; 📈 System Stats shows live progress. ✨"), parse_mode="HTML")
             
         if user.id == OWNER_ID:
             if context.user_data.pop("awaiting_add_admin", None):
-                try: admins_db.add(int(update.message.text.strip())); save_admins(); await update.message.reply_text(premium("<b>✅ Admin added.</b> ✨"), parse_mode="HTML")
-                except: await update.message.reply_text(premium("<b>❌ Invalid ID.</b> 🤡"), parse_mode="HTML")
+                try: admins_db.add(int(update.message.text.strip())); save_admins(); await update.message.reply_text(premium_static("<b>✅ Admin added.</b> ✨"), parse_mode="HTML")
+                except: await update.message.reply_text(premium_static("<b>❌ Invalid ID.</b> 🤡"), parse_mode="HTML")
                 return
             if context.user_data.pop("awaiting_remove_admin", None):
                 try: 
-                    if int(update.message.text.strip()) != OWNER_ID: admins_db.discard(int(update.message.text.strip())); save_admins(); await update.message.reply_text(premium("<b>✅ Removed.</b> 🌸"), parse_mode="HTML")
-                except: await update.message.reply_text(premium("<b>❌ Invalid ID.</b> 🤡"), parse_mode="HTML")
+                    if int(update.message.text.strip()) != OWNER_ID: admins_db.discard(int(update.message.text.strip())); save_admins(); await update.message.reply_text(premium_static("<b>✅ Removed.</b> 🌸"), parse_mode="HTML")
+                except: await update.message.reply_text(premium_static("<b>❌ Invalid ID.</b> 🤡"), parse_mode="HTML")
                 return
 
     if user.id not in admins_db:
@@ -1482,7 +3084,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass 
             return 
             
-        if any(word in msg_lower for word in blacklist_db[chat_id]):
+        if blacklist_hit(chat_id, msg_lower):
             try:
                 await update.message.delete()
                 await context.bot.send_message(chat_id, premium(f"<b>🚫 Watch your language, {_display_name(user)}!</b> ⚠️"), parse_mode="HTML")
@@ -1499,23 +3101,94 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg_lower in filters_db[chat_id]: return await update.message.reply_text(premium(f"<b>{filters_db[chat_id][msg_lower]}</b>"), parse_mode="HTML")
 
     bot_un = context.bot.username.lower() if context.bot.username else ""
-    mentioned = (update.message.entities and any(e.type == "mention" and bot_un in msg_lower for e in update.message.entities)) or any(f in msg_lower for f in filters_db[chat_id].keys())
+    has_mention = any(e.type == "mention" for e in update.message.entities or ())
+    mentioned = trigger_hit(chat_id, msg_lower, bot_un, has_mention)
     replied = update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id
 
     if msg_lower in ["hi","hello","hey","yo","sup","hii","heyy","heya","cindy","cindrella","gm","gn"] and not mentioned and not replied:
         await update.message.reply_text(premium(random.choice(["<b>System Online! 🌸</b>","<b>Guild Manager reporting! 💕</b>","<b>Hey Master! ⚔️</b>","<b>Dungeon ready when you are! ☀️</b>"])), parse_mode="HTML")
     elif mentioned or replied:
-        asyncio.create_task(ai_reply(update, context))
+        queue_ai_reply(update, context)
+
+# ------------- WEBHOOK SERVER -------------
+# RUN_MODE=webhook (the default when WEBHOOK_URL is set) serves Telegram updates,
+# health checks and /metrics from one async server on PORT: no polling loop, no
+# server thread. Telegram proves each POST with the secret token header.
+# RUN_MODE=polling keeps the old long-poll + dummy server setup.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+RUN_MODE = os.environ.get("RUN_MODE", "webhook" if WEBHOOK_URL else "polling").lower()
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()[:48]
+webhook_stats = {"updates": 0, "rejected": 0}
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/html; charset=utf-8")
+        self.write(HEALTH_TEXT)
+
+    def head(self):
+        pass
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        status, body = metrics_response(self.get_query_argument("token", ""))
+        self.set_status(status)
+        if body:
+            self.set_header("Content-Type", "application/json")
+            self.write(body)
+
+class TelegramHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app):
+        self.bot_app = bot_app
+
+    async def post(self):
+        if self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            webhook_stats["rejected"] += 1
+            return self.send_error(403)
+        try: update = Update.de_json(json.loads(self.request.body), self.bot_app.bot)
+        except ValueError: return self.send_error(400)
+        webhook_stats["updates"] += 1
+        await self.bot_app.update_queue.put(update)
+
+async def run_webhook(application):
+    # Same lifecycle as Application.run_polling, with our server in place of the updater
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: pass
+
+    web_app = tornado.web.Application([
+        (r"/", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (rf"/{re.escape(WEBHOOK_PATH)}", TelegramHandler, {"bot_app": application}),
+    ])
+    server = None
+    try:
+        await application.initialize()
+        if application.post_init: await application.post_init(application)
+        server = web_app.listen(int(os.environ.get("PORT", 10000)), xheaders=True)
+        await application.bot.set_webhook(f"{WEBHOOK_URL}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET, drop_pending_updates=True, allowed_updates=ALLOWED_UPDATES)
+        await application.start()
+        await stop.wait()
+    finally:
+        if server:
+            server.stop()
+            await server.close_all_connections()
+        if application.running: await application.stop()
+        if application.post_stop: await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown: await application.post_shutdown(application)
 
 # ------------- MAIN -------------
 def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(UPDATE_CONCURRENCY).post_init(on_startup).post_shutdown(on_shutdown).build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_panel))
     application.add_handler(CommandHandler("id", get_id)) 
     
-    application.add_handler(CallbackQueryHandler(admin_button_handler, pattern="^(broadcast|list_groups|add_admin|remove_admin|list_admins)$"))
+    application.add_handler(CallbackQueryHandler(admin_button_handler, pattern="^(broadcast|list_groups|add_admin|remove_admin|list_admins|sys_stats)$"))
     application.add_handler(CallbackQueryHandler(dungeon_button_handler, pattern="^dungeon_"))
     application.add_handler(CallbackQueryHandler(pvp_button_handler, pattern="^pvp_"))
     application.add_handler(CallbackQueryHandler(shop_button_handler, pattern="^shop_"))
@@ -1556,16 +3229,25 @@ def main():
     application.add_handler(CommandHandler("purgeall", purge_all))
     
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member))
+    application.add_handler(ChatMemberHandler(track_chat_member, ChatMemberHandler.CHAT_MEMBER))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_error_handler(on_error)
 
     if application.job_queue:
         ist = ZoneInfo("Asia/Kolkata")
         application.job_queue.run_daily(couple_daily_reset, time=dt_time(hour=1, minute=0, tzinfo=ist))
+        application.job_queue.run_repeating(flush_job, interval=FLUSH_INTERVAL, first=FLUSH_INTERVAL)
+        application.job_queue.run_repeating(keep_alive, interval=300, first=300)
+
+    if RUN_MODE == "webhook" and WEBHOOK_URL:
+        logging.info(f"🤖 Bot starting in WEBHOOK mode at {WEBHOOK_URL}/{WEBHOOK_PATH} ...")
+        asyncio.run(run_webhook(application))
+        return
 
     threading.Thread(target=run_dummy_server, daemon=True).start()
 
     logging.info("🤖 Bot starting in POLLING mode without server conflicts...")
-    application.run_polling(drop_pending_updates=True)
+    application.run_polling(drop_pending_updates=True, allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()